@@ -0,0 +1,280 @@
+from array import array
+
+IMAGE, TEXT = 1, 2
+# Per-id state in AnnotationStore
+REMOVED, SAVED, UNDOABLE = 0, 1, 2
+
+
+def pack_color(color):
+    # 0-1 RGB -> 0xRRGGBB; the editor's color picker and manifests use 8 bits per channel
+    r, g, b = (min(255, max(0, int(round(c * 255)))) for c in color)
+    return r << 16 | g << 8 | b
+
+
+def unpack_color(value):
+    return ((value >> 16) / 255, (value >> 8 & 0xff) / 255, (value & 0xff) / 255)
+
+
+class ImageAnnotation:
+    # An image placed on a page; coordinates are PDF points from the page's top-left
+    __slots__ = ('id', 'page_num', 'rel_x', 'rel_y', 'rel_w', 'rel_h', 'path')
+    kind = 'image'
+    FIELDS = ('path', 'page_num', 'rel_x', 'rel_y', 'rel_w', 'rel_h')
+
+    def __init__(self, page_num, path, rel_x, rel_y, rel_w, rel_h):
+        self.id = None
+        self.page_num = page_num
+        self.path = path
+        self.rel_x = rel_x
+        self.rel_y = rel_y
+        self.rel_w = rel_w
+        self.rel_h = rel_h
+
+    def bbox(self):
+        return (self.rel_x, self.rel_y, self.rel_x + self.rel_w, self.rel_y + self.rel_h)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class TextAnnotation:
+    # A line of text placed on a page; rel_y is the top of the text box
+    __slots__ = ('id', 'page_num', 'rel_x', 'rel_y', 'text', 'font', 'size', 'color')
+    kind = 'text'
+    FIELDS = ('text', 'page_num', 'rel_x', 'rel_y', 'font', 'size', 'color')
+
+    def __init__(self, page_num, rel_x, rel_y, text, font, size, color):
+        self.id = None
+        self.page_num = page_num
+        self.rel_x = rel_x
+        self.rel_y = rel_y
+        self.text = text
+        self.font = font
+        self.size = size
+        self.color = color
+
+    @property
+    def hex_color(self):
+        return '#%06x' % pack_color(self.color)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+class AnnotationStore:
+    # Holds every annotation under a stable id, together with the undo history
+    # and redo stack. Ids are handed out in order, so each field is a column
+    # in an array indexed by id - 1 and strings (image paths, texts, fonts)
+    # are stored once in a shared table: about 50 bytes per annotation instead
+    # of a few hundred for objects kept in dicts. ImageAnnotation and
+    # TextAnnotation records are built from the columns on request; changing
+    # one does not change the store. Undo works on the most recent addition or
+    # on any annotation id, both in O(1).
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._kind = bytearray()
+        self._state = bytearray()
+        self._page = array('i')
+        self._x = array('f')
+        self._y = array('f')
+        self._w = array('f')
+        self._h = array('f')
+        self._size = array('f')
+        self._color = array('I')
+        self._string = array('I')  # path or text
+        self._font = array('I')
+        # A new table rather than clearing it: snapshots share it
+        self._strings = []
+        self._string_ids = {}
+
+        self._by_page = {}  # page_num -> array of every id ever placed on it; see on_page
+        self._page_counts = {}  # page_num -> number of annotations on it
+        self._count = 0
+
+        # Undoable ids in order of addition. Undoing an arbitrary id only changes
+        # its state; _history_pos tells the current entry of an id from stale ones.
+        self._history = array('I')
+        self._history_pos = array('I')
+        self._undoable = 0
+        self.redo_stack = array('I')
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        state = self._state
+        return (self._record(i + 1) for i in range(len(state)) if state[i] != REMOVED)
+
+    @property
+    def can_undo(self):
+        return self._undoable > 0
+
+    def get(self, annotation_id):
+        if not 0 < annotation_id <= len(self._state) or self._state[annotation_id - 1] == REMOVED:
+            return None
+        return self._record(annotation_id)
+
+    def of_kind(self, kind):
+        code = IMAGE if kind == 'image' else TEXT
+        state, kinds = self._state, self._kind
+        return [self._record(i + 1) for i in range(len(state)) if state[i] != REMOVED and kinds[i] == code]
+
+    def on_page(self, page_num):
+        state = self._state
+        return [self._record(i) for i in self._by_page.get(page_num, ()) if state[i - 1] != REMOVED]
+
+    def ids(self):
+        state = self._state
+        return [i + 1 for i in range(len(state)) if state[i] != REMOVED]
+
+    def pages(self):
+        return sorted(page_num for page_num, count in self._page_counts.items() if count)
+
+    def history_ids(self):
+        # Undoable ids, oldest first
+        state, position = self._state, self._history_pos
+        return [i for p, i in enumerate(self._history) if state[i - 1] == UNDOABLE and position[i - 1] == p]
+
+    def add(self, annotation):
+        annotation.id = len(self._state) + 1
+        self._kind.append(IMAGE if annotation.kind == 'image' else TEXT)
+        self._state.append(REMOVED)
+        self._page.append(annotation.page_num)
+        self._x.append(annotation.rel_x)
+        self._y.append(annotation.rel_y)
+        if annotation.kind == 'image':
+            self._w.append(annotation.rel_w)
+            self._h.append(annotation.rel_h)
+            self._size.append(0)
+            self._color.append(0)
+            self._string.append(self._string_id(annotation.path))
+            self._font.append(0)
+        else:
+            self._w.append(0)
+            self._h.append(0)
+            self._size.append(annotation.size)
+            self._color.append(pack_color(annotation.color))
+            self._string.append(self._string_id(annotation.text))
+            self._font.append(self._string_id(annotation.font))
+        self._history_pos.append(0)
+        self._by_page.setdefault(annotation.page_num, array('I')).append(annotation.id)
+        self._insert(annotation.id)
+        del self.redo_stack[:]
+        return annotation
+
+    def undo(self, annotation_id=None):
+        # Removes the latest addition, or the one with the given id
+        if annotation_id is None:
+            while self._undoable:
+                candidate = self._history.pop()
+                if self._state[candidate - 1] == UNDOABLE and self._history_pos[candidate - 1] == len(self._history):
+                    annotation_id = candidate
+                    break
+            else:
+                return None
+        elif not 0 < annotation_id <= len(self._state) or self._state[annotation_id - 1] != UNDOABLE:
+            return None
+        self._remove(annotation_id)
+        self.redo_stack.append(annotation_id)
+        return self._record(annotation_id)
+
+    def redo(self):
+        if not self.redo_stack:
+            return None
+        annotation_id = self.redo_stack.pop()
+        self._insert(annotation_id)
+        return self._record(annotation_id)
+
+    def mark_saved(self, annotation_ids=None):
+        # Saved annotations are part of the document now and can no longer be undone.
+        # annotation_ids limits this to the ones a (background) save actually wrote.
+        if annotation_ids is None:
+            annotation_ids = self.history_ids()
+            del self.redo_stack[:]
+        saved = set(annotation_ids)
+        for annotation_id in saved:
+            if self._state[annotation_id - 1] == UNDOABLE:
+                self._state[annotation_id - 1] = SAVED
+                self._undoable -= 1
+        self.redo_stack = array('I', (i for i in self.redo_stack if i not in saved))
+        self._compact_history()
+
+    def discard(self, annotation_ids):
+        # Drops annotations for good, e.g. once the file itself holds them. Their
+        # ids are not reused; only the few bytes of their columns stay behind.
+        discarded = set(annotation_ids)
+        pages = set()
+        for annotation_id in discarded:
+            i = annotation_id - 1
+            if self._state[i] == UNDOABLE:
+                self._undoable -= 1
+            if self._state[i] != REMOVED:
+                self._count -= 1
+                self._page_counts[self._page[i]] -= 1
+            self._state[i] = REMOVED
+            pages.add(self._page[i])
+        self.redo_stack = array('I', (i for i in self.redo_stack if i not in discarded))
+        redoable = set(self.redo_stack)
+        for page_num in pages:
+            self._by_page[page_num] = array('I', (i for i in self._by_page[page_num]
+                                                  if self._state[i - 1] != REMOVED or i in redoable))
+        self._compact_history()
+
+    def snapshot(self):
+        # Independent copy of the current state for a background save. The columns
+        # are copied; the string table only ever grows, so it is shared.
+        store = AnnotationStore.__new__(AnnotationStore)
+        for name, value in self.__dict__.items():
+            if isinstance(value, (array, bytearray)):
+                value = value[:]
+            elif name == '_by_page':
+                value = {page_num: ids[:] for page_num, ids in value.items()}
+            elif name == '_page_counts':
+                value = dict(value)
+            setattr(store, name, value)
+        return store
+
+    def _string_id(self, string):
+        string_id = self._string_ids.get(string)
+        if string_id is None:
+            string_id = self._string_ids[string] = len(self._strings)
+            self._strings.append(string)
+        return string_id
+
+    def _record(self, annotation_id):
+        i = annotation_id - 1
+        if self._kind[i] == IMAGE:
+            annotation = ImageAnnotation(self._page[i], self._strings[self._string[i]],
+                                         self._x[i], self._y[i], self._w[i], self._h[i])
+        else:
+            annotation = TextAnnotation(self._page[i], self._x[i], self._y[i], self._strings[self._string[i]],
+                                        self._strings[self._font[i]], self._size[i], unpack_color(self._color[i]))
+        annotation.id = annotation_id
+        return annotation
+
+    def _insert(self, annotation_id):
+        # Ids stay in their page's array when removed, so redo has nothing to re-insert there
+        i = annotation_id - 1
+        self._state[i] = UNDOABLE
+        self._history_pos[i] = len(self._history)
+        self._history.append(annotation_id)
+        self._undoable += 1
+        self._count += 1
+        self._page_counts[self._page[i]] = self._page_counts.get(self._page[i], 0) + 1
+        if len(self._history) > 2 * self._undoable + 1024:
+            self._compact_history()
+
+    def _remove(self, annotation_id):
+        i = annotation_id - 1
+        self._state[i] = REMOVED
+        self._undoable -= 1
+        self._count -= 1
+        self._page_counts[self._page[i]] -= 1
+
+    def _compact_history(self):
+        # Drops the entries of ids that were undone, saved or redone later
+        self._history = array('I', self.history_ids())
+        for position, annotation_id in enumerate(self._history):
+            self._history_pos[annotation_id - 1] = position
@@ -0,0 +1,79 @@
+import queue
+import threading
+from collections import deque
+
+from pdf_engine import open_document
+
+
+class BackgroundWorker:
+    # What the editor's background jobs (RenderScheduler, ThumbnailLoader,
+    # TextIndexer) have in common: daemon threads running _worker, each with
+    # its own document from open_document, and a root.after poll that hands
+    # their results to the Tk thread. Subclasses set up their own state, then
+    # call _start(); _poll calls _deliver() and keeps polling while _active().
+    POLL_MS = 50
+
+    def __init__(self, root, file_path, data=None, threads=1):
+        self.root = root
+        self.file_path = file_path
+        self.data = data
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._results = queue.SimpleQueue()
+        self._closed = False
+        self._poll_id = None
+        self._threads = [threading.Thread(target=self._worker, daemon=True) for _ in range(threads)]
+
+    def _start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+        if self._poll_id is not None:
+            self.root.after_cancel(self._poll_id)
+            self._poll_id = None
+
+    def join(self, timeout=None):
+        # After close(): waits for the workers to finish the page at hand and close their documents
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _open_document(self):
+        return open_document(self.file_path, self.data)
+
+    def _next_item(self):
+        # Blocks until something is pending and returns it, or None once closed.
+        # _taking(item) runs under the same lock, e.g. to mark the item busy.
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if self._closed:
+                return None
+            item = self._pending.popleft()
+            self._taking(item)
+            return item
+
+    def _taking(self, item):
+        pass
+
+    def _poll_soon(self):
+        if self._poll_id is None:
+            self._poll_id = self.root.after(self.POLL_MS, self._poll)
+
+    def _poll(self):
+        self._poll_id = None
+        self._deliver()
+        if self._active():
+            self._poll_soon()
+
+    def _results_so_far(self):
+        while True:
+            try:
+                yield self._results.get_nowait()
+            except queue.Empty:
+                return
@@ -0,0 +1,360 @@
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+from PIL import Image, ImageDraw
+
+from pdf_engine import PDFEditEngine
+from rendering import photo_image_nbytes, ppm_photo_image, render_page_ppm, render_page_samples
+
+PAGE_SIZES = {'letter': (612, 792), 'a4': (595, 842), 'a3-landscape': (1191, 842)}
+# 'mixed' cycles through every size in PAGE_SIZES
+
+LOREM = ("Lorem ipsum dolor sit amet, consectetur adipiscing elit, sed do eiusmod tempor incididunt ut "
+         "labore et dolore magna aliqua. Ut enim ad minim veniam, quis nostrud exercitation ullamco. ")
+
+
+def page_size(size_name, page_num):
+    if size_name == 'mixed':
+        names = list(PAGE_SIZES)
+        return PAGE_SIZES[names[page_num % len(names)]]
+    return PAGE_SIZES[size_name]
+
+
+def _draw_vector_page(page, rng):
+    width, height = page.rect.width, page.rect.height
+    shape = page.new_shape()
+    for _ in range(150):
+        shape.draw_line((rng.uniform(0, width), rng.uniform(0, height)), (rng.uniform(0, width), rng.uniform(0, height)))
+    shape.finish(color=(0.2, 0.3, 0.6), width=0.5)
+    for _ in range(40):
+        x, y = rng.uniform(0, width - 60), rng.uniform(0, height - 40)
+        shape.draw_rect(fitz.Rect(x, y, x + rng.uniform(10, 60), y + rng.uniform(10, 40)))
+    shape.finish(color=(0, 0, 0), fill=(0.9, 0.85, 0.6), width=0.3)
+    for _ in range(20):
+        points = [(rng.uniform(0, width), rng.uniform(0, height)) for _ in range(4)]
+        shape.draw_bezier(*points)
+    shape.finish(color=(0.7, 0.1, 0.1), width=1)
+    shape.commit()
+    page.insert_textbox(fitz.Rect(40, 40, width - 40, height - 40), LOREM * 12, fontsize=9)
+
+
+def _scan_base(width, height, rng):
+    # Grey paper with dark bars standing in for lines of text
+    img = Image.effect_noise((width, height), 12).point(lambda v: 200 + v // 8)
+    draw = ImageDraw.Draw(img)
+    y = 60
+    while y < height - 60:
+        draw.rectangle((60, y, 60 + rng.randint(width // 3, width - 120), y + 10), fill=40)
+        y += 24
+    return img
+
+
+def _draw_scanned_page(page, page_num, bases):
+    # Every page gets its own JPEG, like a real scan, so nothing is deduplicated
+    img = bases[page_num % len(bases)].copy()
+    ImageDraw.Draw(img).text((img.width - 120, img.height - 40), f"- {page_num + 1} -", fill=0)
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=70)
+    page.insert_image(page.rect, stream=buffer.getvalue())
+
+
+def generate_pdf(path, kind, pages, size='letter', seed=0):
+    # Synthetic test document: 'vector' pages are full of paths and text,
+    # 'scanned' pages are one greyscale JPEG each at 100 dpi
+    rng = random.Random(seed)
+    bases = {}
+    doc = fitz.open()
+    try:
+        for page_num in range(pages):
+            width, height = page_size(size, page_num)
+            page = doc.new_page(width=width, height=height)
+            if kind == 'vector':
+                _draw_vector_page(page, rng)
+            elif kind == 'scanned':
+                dims = (int(width / 72 * 100), int(height / 72 * 100))
+                if dims not in bases:
+                    bases[dims] = [_scan_base(*dims, rng) for _ in range(3)]
+                _draw_scanned_page(page, page_num, bases[dims])
+            else:
+                raise ValueError(f"unknown document kind: {kind}")
+        doc.save(path, garbage=1, deflate=True)
+    finally:
+        doc.close()
+
+
+def make_stamp_image(path):
+    img = Image.new('RGBA', (400, 200), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    draw.rounded_rectangle((4, 4, 396, 196), radius=24, outline=(200, 20, 20, 255), width=10)
+    draw.text((150, 90), "APPROVED", fill=(200, 20, 20, 255))
+    img.save(path)
+
+
+def corpus_path(corpus_dir, kind, pages, size):
+    return os.path.join(corpus_dir, f"{kind}-{size}-{pages}.pdf")
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _ms(start):
+    return (time.perf_counter() - start) * 1000
+
+
+def _sample_pages(page_count, count):
+    if page_count <= count:
+        return list(range(page_count))
+    step = page_count / count
+    return [int(i * step) for i in range(count)]
+
+
+def run_case(pdf_path, stamp_path, work_dir, zooms, render_pages, stamps):
+    # Runs in a fresh process so that peak RSS belongs to this document alone
+    result = {'file_bytes': os.path.getsize(pdf_path)}
+
+    # Open as the editor does, then the first page as a render worker would
+    start = time.perf_counter()
+    engine = PDFEditEngine()
+    engine.open(pdf_path)
+    result['open_ms'] = _ms(start)
+    doc = fitz.open(pdf_path)
+    render_page_samples(doc, 0, 1.0)
+    result['first_render_ms'] = _ms(start)
+    result['page_count'] = engine.page_count
+
+    start = time.perf_counter()
+    while engine.page_sizes_pending:
+        engine.resolve_page_sizes()
+    result['resolve_page_sizes_ms'] = _ms(start)
+
+    result['render'] = {}
+    pages = _sample_pages(engine.page_count, render_pages)
+    for zoom in zooms:
+        pixels = 0
+        start = time.perf_counter()
+        for page_num in pages:
+            width, height, _ = render_page_samples(doc, page_num, zoom)
+            pixels += width * height
+        seconds = time.perf_counter() - start
+        result['render'][str(zoom)] = {
+            'pages': len(pages),
+            'pages_per_s': len(pages) / seconds if seconds else 0.0,
+            'megapixels_per_s': pixels / 1e6 / seconds if seconds else 0.0,
+        }
+    result['to_tk'] = {str(max(zooms)): _bench_to_tk(doc, pages, max(zooms))}
+    doc.close()
+
+    result['overlays'] = _bench_overlays(engine, stamp_path, stamps, zooms)
+
+    result['save'] = {}
+    for mode, options in (('incremental', {}), ('compact', {'compact': True})):
+        output_path = os.path.join(work_dir, f"save-{mode}.pdf")
+        start = time.perf_counter()
+        engine.save(output_path, **options)
+        result['save'][mode] = {'ms': _ms(start), 'bytes': os.path.getsize(output_path)}
+        os.remove(output_path)
+
+    engine.close()
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def _bench_to_tk(doc, pages, zoom):
+    # Rendered page -> Tk photo image, the old way (raw samples, Pillow image,
+    # ImageTk) against binary PPM decoded by Tk itself. render_ms is worker
+    # time, tk_ms the part that blocks the event loop; it needs a display and
+    # is None without one. The bytes are estimates worked out from the image
+    # size, not measured: Pillow, Tcl and Tk allocate outside Python's
+    # allocator, where tracemalloc cannot see them. bytes_copied_estimate adds
+    # up every buffer the pixels are copied into on the way to Tk, bytes_kept
+    # what the editor's RenderCache then holds per page: the photo image plus
+    # the source kept for rescaled previews (the Pillow image, or the PPM).
+    # Pillow and Tk both store RGB at 4 bytes per pixel.
+    # Tk is imported here so that the rest of the benchmark runs where it is not installed
+    root = None
+    try:
+        import tkinter as tk
+        from PIL import ImageTk
+    except ImportError:
+        tk = ImageTk = None
+    if tk is not None:
+        try:
+            root = tk.Tk()
+            root.withdraw()
+        except tk.TclError:
+            root = None  # no display
+    paths = {'pil': (render_page_samples, lambda w, h, samples: ImageTk.PhotoImage(Image.frombytes("RGB", (w, h), samples))),
+             'ppm': (render_page_ppm, lambda w, h, ppm: ppm_photo_image(ppm))}
+    results = {}
+    for name, (render, to_photo) in paths.items():
+        render_s = tk_s = 0.0
+        copied = kept = 0
+        for page_num in pages:
+            start = time.perf_counter()
+            width, height, pixels = render(doc, page_num, zoom)
+            render_s += time.perf_counter() - start
+            photo = photo_image_nbytes(width, height)
+            if name == 'pil':
+                # samples -> Pillow image -> Tk photo
+                copied += len(pixels) + width * height * 4 + photo
+                kept += width * height * 4 + photo
+            else:
+                # pixmap -> PPM bytes -> Tcl byte array (made by tkinter) -> Tk photo
+                copied += 2 * len(pixels) + photo
+                kept += len(pixels) + photo
+            if root is not None:
+                start = time.perf_counter()
+                to_photo(width, height, pixels)
+                tk_s += time.perf_counter() - start
+        results[name] = {
+            'render_ms': render_s * 1000 / len(pages),
+            'tk_ms': tk_s * 1000 / len(pages) if root is not None else None,
+            'bytes_copied_estimate': copied // len(pages),
+            'bytes_kept': kept // len(pages),
+        }
+    if root is not None:
+        root.destroy()
+    return results
+
+
+def _bench_overlays(engine, stamp_path, stamps, zooms):
+    # The non-Tk part of redrawing N stamps: adding them (with hit-test
+    # indexing), resampling each distinct image size the way ImageCache does for
+    # a zoom change (fast filter first, then the sharp one) and hit-testing.
+    rng = random.Random(1)
+    start = time.perf_counter()
+    for i in range(stamps):
+        page_num = rng.randrange(engine.page_count)
+        if i % 2:
+            engine.add_text(page_num, rng.uniform(20, 400), rng.uniform(20, 600), f"Stamp {i}", size=rng.choice((9, 12, 18)))
+        else:
+            scale = rng.choice((0.25, 0.4, 0.5, 0.75))
+            engine.add_image(page_num, stamp_path, rng.uniform(20, 300), rng.uniform(20, 500), 400 * scale, 200 * scale)
+    add_ms = _ms(start)
+
+    with Image.open(stamp_path) as source:
+        source.load()
+        redraw = {}
+        for zoom in zooms:
+            sizes = {(max(1, int(item.rel_w * zoom)), max(1, int(item.rel_h * zoom))) for item in engine.images_to_embed}
+            start = time.perf_counter()
+            for size in sizes:
+                source.resize(size, Image.NEAREST)
+            fast_ms = _ms(start)
+            start = time.perf_counter()
+            for size in sizes:
+                source.resize(size, Image.LANCZOS)
+            redraw[str(zoom)] = {'distinct_sizes': len(sizes), 'fast_ms': fast_ms, 'sharp_ms': _ms(start)}
+
+    queries = 2000
+    start = time.perf_counter()
+    for _ in range(queries):
+        engine.overlay_at(rng.randrange(engine.page_count), rng.uniform(0, 600), rng.uniform(0, 800))
+    hit_test_us = _ms(start) * 1000 / queries
+
+    return {'stamps': stamps, 'add_ms': add_ms, 'resample': redraw, 'hit_test_us': hit_test_us}
+
+
+def run_benchmarks(corpus_dir=None, kinds=('vector', 'scanned'), pages=(10, 1000, 10000), sizes=('letter', 'mixed'),
+                   max_scanned_pages=500, zooms=(0.5, 1.0, 2.0), render_pages=20, stamps=500, on_case=None):
+    # Generates any missing corpus files, then measures each one in its own
+    # process. Returns a JSON-serializable dict.
+    corpus_dir = corpus_dir or os.path.join(tempfile.gettempdir(), 'xocopdfeditor-bench')
+    os.makedirs(corpus_dir, exist_ok=True)
+    stamp_path = os.path.join(corpus_dir, 'stamp.png')
+    if not os.path.exists(stamp_path):
+        make_stamp_image(stamp_path)
+
+    cases = []
+    for kind in kinds:
+        for page_count in pages:
+            if kind == 'scanned' and page_count > max_scanned_pages:
+                continue
+            for size in sizes:
+                cases.append((kind, page_count, size))
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for kind, page_count, size in cases:
+        path = corpus_path(corpus_dir, kind, page_count, size)
+        generated_ms = None
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            generate_pdf(path, kind, page_count, size)
+            generated_ms = _ms(start)
+        with tempfile.TemporaryDirectory() as work_dir:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                metrics = pool.submit(run_case, path, stamp_path, work_dir, list(zooms), render_pages, stamps).result()
+        case = {'name': f"{kind}-{size}-{page_count}", 'kind': kind, 'pages': page_count, 'size': size,
+                'generate_ms': generated_ms, 'metrics': metrics}
+        results.append(case)
+        if on_case: on_case(case)
+
+    return {
+        'format': 1,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'environment': {
+            'python': platform.python_version(),
+            'pymupdf': fitz.VersionBind,
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+        },
+        'settings': {'zooms': list(zooms), 'render_pages': render_pages, 'stamps': stamps},
+        'cases': results,
+    }
+
+
+def flatten_metrics(value, prefix=''):
+    # {'save': {'compact': {'ms': 3}}} -> {'save.compact.ms': 3}
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(flatten_metrics(item, f"{prefix}.{key}" if prefix else key))
+        return flat
+    return {prefix: value} if isinstance(value, (int, float)) and not isinstance(value, bool) else {}
+
+
+def compare_results(baseline, current, threshold=0.10, min_ms=1.0):
+    # Lists (case, metric, old, new, change) for every metric that moved by more
+    # than threshold in the wrong direction. Throughputs (*_per_s) should go up,
+    # times, sizes and memory should go down. Timings below min_ms are too noisy
+    # to judge and are skipped.
+    regressions = []
+    old_cases = {case['name']: case for case in baseline.get('cases', [])}
+    for case in current.get('cases', []):
+        old_case = old_cases.get(case['name'])
+        if old_case is None: continue
+        old_metrics = flatten_metrics(old_case['metrics'])
+        for metric, new in flatten_metrics(case['metrics']).items():
+            old = old_metrics.get(metric)
+            if not old or metric.endswith(('page_count', 'pages', 'stamps', 'distinct_sizes', 'file_bytes')):
+                continue
+            if metric.endswith('_ms') and max(old, new) < min_ms:
+                continue
+            change = (new - old) / old
+            worse = -change if metric.endswith('_per_s') else change
+            if worse > threshold:
+                regressions.append((case['name'], metric, old, new, change))
+    return regressions
+
+
+def write_results(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,58 @@
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+
+
+def cache_dir(name):
+    # Per-user cache directory of one kind of cached data, e.g. 'thumbnails'
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or tempfile.gettempdir()
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'xocopdfeditor', name)
+
+
+def write_atomic(path, data):
+    # Written to a temporary file and renamed, so readers never see half a file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def file_content_hash(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SharedDigest:
+    # The content hash of one file for several background workers that key
+    # their caches by it. The first get() computes it with content_hash(path);
+    # workers asking meanwhile wait for that result instead of hashing the
+    # file again. '' means the file could not be read, i.e. no caching.
+    def __init__(self, path, content_hash=file_content_hash):
+        self.path = path
+        self.content_hash = content_hash
+        self._digest = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._digest is None:
+                try:
+                    self._digest = self.content_hash(self.path)
+                except OSError:
+                    self._digest = ''
+            return self._digest
@@ -0,0 +1,60 @@
+import json
+import marshal
+import os
+import tempfile
+
+from cache_files import write_atomic
+
+# Found next to the module, so the editor can be started from any directory
+TRANSLATIONS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'translations.json')
+CATALOG_FORMAT = 1
+
+
+def _catalog_dirs():
+    # Next to the module like Python's own bytecode cache, or the temp
+    # directory when the install location is read-only
+    return [os.path.join(os.path.dirname(TRANSLATIONS_PATH), '__pycache__'),
+            os.path.join(tempfile.gettempdir(), 'xocopdfeditor-catalogs')]
+
+
+def _catalog_path(directory, language):
+    return os.path.join(directory, f"translations.{language}.marshal")
+
+
+def _signature(json_path):
+    stat = os.stat(json_path)
+    return (CATALOG_FORMAT, os.path.abspath(json_path), stat.st_size, stat.st_mtime_ns)
+
+
+def load_catalog(language, json_path=TRANSLATIONS_PATH):
+    # Returns (strings, languages) for one language. The strings come from a
+    # small per-language catalog that is rebuilt whenever the JSON file changes,
+    # so startup reads a few KB instead of parsing every language.
+    signature = _signature(json_path)
+    for directory in _catalog_dirs():
+        try:
+            with open(_catalog_path(directory, language), 'rb') as f:
+                catalog = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            continue
+        if isinstance(catalog, dict) and catalog.get('signature') == signature:
+            return catalog['strings'], catalog['languages']
+    return _rebuild_catalogs(json_path, signature, language)
+
+
+def _rebuild_catalogs(json_path, signature, language):
+    with open(json_path, 'r', encoding='utf-8') as f:
+        translations = json.load(f)
+    languages = sorted(code for code, strings in translations.items() if isinstance(strings, dict))
+    for directory in _catalog_dirs():
+        try:
+            os.makedirs(directory, exist_ok=True)
+            for code in languages:
+                catalog = {'signature': signature, 'languages': languages, 'strings': translations[code]}
+                write_atomic(_catalog_path(directory, code), marshal.dumps(catalog))
+            break
+        except OSError:
+            continue  # not writable; try the next location, or just run uncached
+    strings = translations.get(language)
+    return (strings if isinstance(strings, dict) else {}), languages
+
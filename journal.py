@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+import tempfile
+
+
+def journal_path_for(pdf_path):
+    # Sidecar next to the PDF when that directory is writable, otherwise a
+    # per-file journal in the temp directory
+    pdf_path = os.path.abspath(pdf_path)
+    if os.access(os.path.dirname(pdf_path), os.W_OK):
+        return pdf_path + '.xoco-journal'
+    digest = hashlib.sha1(pdf_path.encode('utf-8')).hexdigest()
+    return os.path.join(tempfile.gettempdir(), 'xocopdfeditor-journals', digest + '.jsonl')
+
+
+def _file_signature(pdf_path):
+    stat = os.stat(pdf_path)
+    return {'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+
+class AutosaveJournal:
+    # Append-only log of editing actions for one PDF. Records are buffered and
+    # written with a single fsync per flush(), so the cost of an autosave
+    # depends on the edits made since the last one, not on the document size.
+    def __init__(self, pdf_path):
+        self.pdf_path = pdf_path
+        self.path = journal_path_for(pdf_path)
+        self._buffer = []
+        self._file = None
+
+    @property
+    def pending(self):
+        return bool(self._buffer)
+
+    def start(self, annotations=()):
+        # Begins a fresh journal, seeded with the annotations that are not saved yet
+        self.close()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'w', encoding='utf-8')
+        self._buffer = [dict(op='open', pdf=os.path.basename(self.pdf_path), **_file_signature(self.pdf_path))]
+        for annotation in annotations:
+            self.record_add(annotation)
+        self.flush()
+
+    def record_add(self, annotation):
+        self._buffer.append(dict(op='add', id=annotation.id, kind=annotation.kind, **annotation.to_dict()))
+
+    def record_undo(self, annotation):
+        self._buffer.append({'op': 'undo', 'id': annotation.id})
+
+    def record_redo(self, annotation):
+        # With the full data, so a redo of something undone before the journal
+        # was (re)started can be replayed as an addition
+        self._buffer.append(dict(op='redo', id=annotation.id, kind=annotation.kind, **annotation.to_dict()))
+
+    def flush(self):
+        if not self._buffer or self._file is None:
+            return
+        self._file.write(''.join(json.dumps(record, separators=(',', ':')) + '\n' for record in self._buffer))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._buffer = []
+
+    def close(self):
+        if self._file is not None:
+            self.flush()
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        self._buffer = []
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def read_unsaved_actions(pdf_path):
+    # Returns the journaled action records for pdf_path, or [] when there is no
+    # journal or it belongs to a different version of the file
+    path = journal_path_for(pdf_path)
+    if not os.path.exists(path):
+        return []
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break  # a torn final write from a crash; everything before it is intact
+    if not records or records[0].get('op') != 'open':
+        return []
+    header = records[0]
+    if {'size': header.get('size'), 'mtime': header.get('mtime')} != _file_signature(pdf_path):
+        return []
+    return records[1:]
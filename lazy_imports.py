@@ -0,0 +1,25 @@
+import importlib.util
+import sys
+
+
+def lazy_import(name):
+    # Registers the module but only executes it on first attribute access, so
+    # importing the editor does not pay for PyMuPDF and Pillow before the window
+    # is up. The first access must not race between threads (Python < 3.12's
+    # LazyLoader has no lock); the editor touches fitz on the Tk thread when a
+    # document is opened, before any worker starts.
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError(f"No module named {name!r}", name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    parent, _, child = name.rpartition('.')
+    if parent:
+        setattr(sys.modules[parent], child, module)
+    return module
@@ -0,0 +1,31 @@
+from collections import deque
+
+
+class LatencyMeter:
+    # Rolling window of per-event handling times, reported in milliseconds
+    def __init__(self, window=240):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds):
+        self.samples.append(seconds * 1000)
+        self.count += 1
+
+    def reset(self):
+        self.samples.clear()
+        self.count = 0
+
+    @property
+    def last_ms(self):
+        return self.samples[-1] if self.samples else 0.0
+
+    @property
+    def avg_ms(self):
+        return sum(self.samples) / len(self.samples) if self.samples else 0.0
+
+    @property
+    def max_ms(self):
+        return max(self.samples) if self.samples else 0.0
+
+    def summary(self):
+        return {'count': self.count, 'last_ms': self.last_ms, 'avg_ms': self.avg_ms, 'max_ms': self.max_ms}
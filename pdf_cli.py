@@ -0,0 +1,175 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+import fitz  # PyMuPDF
+
+from pdf_engine import PDFEditEngine, parse_page_range
+from pdf_export import export_pages
+from mail_merge import merge_to_combined, merge_to_files, read_rows
+
+
+def stamp_command(args):
+    with open(args.manifest, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+
+    start = time.perf_counter()
+    engine = PDFEditEngine(args.input)
+    engine.downsample_images = args.downsample_images
+    engine.image_target_dpi = args.dpi
+    engine.apply_manifest(manifest, base_dir=os.path.dirname(os.path.abspath(args.manifest)))
+    # Counted first: saving over the input drops what it wrote from the engine
+    placements = len(engine.annotations)
+    engine.save(args.output, compact=args.compact)
+    engine.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"Applied {placements} placements to {args.output} in {elapsed:.2f}s "
+          f"({placements / elapsed if elapsed else 0:.0f} placements/s)")
+    return 0
+
+
+def export_command(args):
+    manifest = {}
+    base_dir = '.'
+    if args.manifest:
+        with open(args.manifest, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    # Resolve image paths here so worker processes do not depend on the manifest location
+    engine = PDFEditEngine()
+    engine.apply_manifest(manifest, base_dir=base_dir)
+    pages = None
+    if args.pages:
+        with fitz.open(args.input) as doc:
+            pages = parse_page_range(args.pages, doc.page_count)
+
+    start = time.perf_counter()
+    written = export_pages(args.input, args.output_dir, manifest=engine.to_manifest(), dpi=args.dpi,
+                           fmt=args.format, workers=args.workers, chunk_size=args.chunk_size, pages=pages)
+    elapsed = time.perf_counter() - start
+    print(f"Exported {len(written)} pages to {args.output_dir} in {elapsed:.2f}s "
+          f"({len(written) / elapsed if elapsed else 0:.1f} pages/s)")
+    return 0
+
+
+def merge_command(args):
+    with open(args.template, 'r', encoding='utf-8') as f:
+        template = json.load(f)
+    base_dir = os.path.dirname(os.path.abspath(args.template))
+    rows = read_rows(args.data)
+
+    start = time.perf_counter()
+    if args.combined:
+        count = merge_to_combined(args.input, template, rows, args.output, base_dir=base_dir)
+    else:
+        count = merge_to_files(args.input, template, rows, args.output, base_dir=base_dir,
+                               workers=args.workers, chunk_size=args.chunk_size)
+    elapsed = time.perf_counter() - start
+    print(f"Merged {count} rows in {elapsed:.2f}s ({count / elapsed if elapsed else 0:.1f} rows/s)")
+    return 0
+
+
+def bench_command(args):
+    # Imported here: the benchmark loads Pillow up front, which the other commands only load when they need it
+    from benchmark import compare_results, run_benchmarks, write_results
+
+    # --quick only changes the defaults; explicit options still win
+    pages = args.pages or ([10, 100] if args.quick else [10, 1000, 10000])
+    stamps = args.stamps or (100 if args.quick else 500)
+    render_pages = args.render_pages or (5 if args.quick else 20)
+
+    def on_case(case):
+        metrics = case['metrics']
+        print(f"{case['name']}: open {metrics['open_ms']:.1f} ms, first render {metrics['first_render_ms']:.1f} ms, "
+              f"save {metrics['save']['incremental']['ms']:.1f} ms, peak RSS {metrics['peak_rss_mb'] or 0:.0f} MB")
+        for zoom, paths in metrics['to_tk'].items():
+            pil, ppm = paths['pil'], paths['ppm']
+            tk_times = f", Tk {pil['tk_ms']:.1f} -> {ppm['tk_ms']:.1f} ms" if ppm['tk_ms'] is not None else ""
+            print(f"  to Tk at {zoom}x: ~{pil['bytes_copied_estimate'] / 1e6:.1f} -> ~{ppm['bytes_copied_estimate'] / 1e6:.1f} MB "
+                  f"copied and {pil['bytes_kept'] / 1e6:.1f} -> {ppm['bytes_kept'] / 1e6:.1f} MB kept per page, "
+                  f"render {pil['render_ms']:.1f} -> {ppm['render_ms']:.1f} ms{tk_times}")
+
+    results = run_benchmarks(corpus_dir=args.corpus_dir, kinds=args.kinds, pages=pages, sizes=args.sizes,
+                             max_scanned_pages=args.max_scanned_pages, zooms=args.zooms,
+                             render_pages=render_pages, stamps=stamps, on_case=on_case)
+    write_results(results, args.output)
+    print(f"Wrote {len(results['cases'])} results to {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(baseline, results, threshold=args.threshold)
+        for name, metric, old, new, change in regressions:
+            print(f"REGRESSION {name} {metric}: {old:.4g} -> {new:.4g} ({change:+.0%})")
+        return 1 if regressions else 0
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Headless Xcoco PDF Editor tools.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    stamp = subparsers.add_parser('stamp', help="Apply a JSON manifest of text/image placements to a PDF.")
+    stamp.add_argument('input', help="PDF to stamp")
+    stamp.add_argument('manifest', help="JSON file with 'images' and 'text' placement lists")
+    stamp.add_argument('-o', '--output', required=True, help="Where to write the stamped PDF")
+    stamp.add_argument('--downsample-images', action='store_true',
+                       help="Downsample placed images to the DPI of their placement rectangle")
+    stamp.add_argument('--dpi', type=int, default=150, help="Target DPI for --downsample-images (default: 150)")
+    stamp.add_argument('--compact', action='store_true',
+                       help="Rewrite the whole file with unused objects removed and streams deflated "
+                            "(default: append the changes to a copy of the input)")
+    stamp.set_defaults(func=stamp_command)
+
+    export = subparsers.add_parser('export', help="Rasterize every page (with overlays) to PNG/JPEG files.")
+    export.add_argument('input', help="PDF to export")
+    export.add_argument('-d', '--output-dir', required=True, help="Directory for the page images")
+    export.add_argument('-m', '--manifest', help="Optional JSON placement manifest to draw on the pages")
+    export.add_argument('--dpi', type=int, default=150, help="Output resolution (default: 150)")
+    export.add_argument('--format', choices=('png', 'jpg', 'jpeg'), default='png', help="Image format (default: png)")
+    export.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU)")
+    export.add_argument('--chunk-size', type=int, default=16, help="Pages handed to a worker at a time (default: 16)")
+    export.add_argument('--pages', help="Page range to export, e.g. '1-3,7,10-' (default: all pages)")
+    export.set_defaults(func=export_command)
+
+    merge = subparsers.add_parser('merge', help="Stamp one personalized copy of a PDF per data row.")
+    merge.add_argument('input', help="Base PDF")
+    merge.add_argument('template', help="JSON placement manifest; text and image paths may use {field} placeholders")
+    merge.add_argument('data', help="CSV file with a header row, or a .jsonl file with one object per line")
+    merge.add_argument('-o', '--output', required=True,
+                       help="Output path pattern such as 'out/{row:05d}-{name}.pdf', or a single file with --combined")
+    merge.add_argument('--combined', action='store_true', help="Write all copies into one PDF instead of one file per row")
+    merge.add_argument('--workers', type=int, default=1, help="Worker processes for per-row output (default: 1)")
+    merge.add_argument('--chunk-size', type=int, default=32, help="Rows handed to a worker at a time (default: 32)")
+    merge.set_defaults(func=merge_command)
+
+    bench = subparsers.add_parser('bench', help="Benchmark open, render, overlay and save on synthetic PDFs.")
+    bench.add_argument('-o', '--output', default='bench-results.json', help="JSON results file (default: bench-results.json)")
+    bench.add_argument('--corpus-dir', help="Where generated PDFs are kept between runs (default: a temp directory)")
+    bench.add_argument('--kinds', nargs='+', choices=('vector', 'scanned'), default=['vector', 'scanned'])
+    bench.add_argument('--pages', nargs='+', type=int, help="Document lengths to test (default: 10 1000 10000)")
+    bench.add_argument('--sizes', nargs='+', choices=('letter', 'a4', 'a3-landscape', 'mixed'), default=['letter', 'mixed'])
+    bench.add_argument('--max-scanned-pages', type=int, default=500,
+                       help="Skip scanned documents longer than this; they take a lot of disk (default: 500)")
+    bench.add_argument('--zooms', nargs='+', type=float, default=[0.5, 1.0, 2.0], help="Zoom levels to render at")
+    bench.add_argument('--render-pages', type=int, help="Pages rendered per zoom level (default: 20)")
+    bench.add_argument('--stamps', type=int, help="Overlays placed for the overlay and save tests (default: 500)")
+    bench.add_argument('--quick', action='store_true',
+                       help="Defaults to 10 and 100 page documents, 100 stamps and 5 rendered pages, for a fast check")
+    bench.add_argument('--compare', help="Earlier results file; regressions are listed and the exit code is 1")
+    bench.add_argument('--threshold', type=float, default=0.10, help="Relative change counted as a regression (default: 0.10)")
+    bench.set_defaults(func=bench_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,28 @@
+import time
+STARTED_AT_NS = time.perf_counter_ns()  # taken before the other imports, for the time-to-window figure
 import tkinter as tk
 from tkinter import filedialog, messagebox, Canvas, Scrollbar, simpledialog, colorchooser
-import fitz  # PyMuPDF
-from PIL import Image, ImageTk
 import os
 import platform
 import subprocess
 import tempfile
-import json
+import threading
+from cache_files import SharedDigest
+from i18n import load_catalog
+from lazy_imports import lazy_import
+from metrics import LatencyMeter
+from pdf_engine import PDFEditEngine, ReplaceFailed, SaveCancelled, parse_page_range
+from journal import read_unsaved_actions
+from spatial_index import find_offset_index
+from text_index import TextIndexer
+from thumbnails import ThumbnailSidebar
+from tracing import traced, tracer
+from rendering import (TILE_SIZE, ImageCache, RenderCache, RenderScheduler, photo_image_nbytes, ppm_photo_image,
+                       ppm_to_image, start_render_processes)
+
+# Pillow (like PyMuPDF in the modules above) is only loaded once a document is opened
+Image = lazy_import('PIL.Image')
+ImageTk = lazy_import('PIL.ImageTk')
 
 class TextPropertiesDialog(simpledialog.Dialog):
     def __init__(self, parent, translator):
@@ -67,23 +83,53 @@ class TextPropertiesDialog(simpledialog.Dialog):
 class PDFEditor:
     def __init__(self, root):
         self.root = root
-        self._load_translations()
         self.language = 'en' # Default language
+        self._load_translations()
         self.language_var = tk.StringVar(value=self.language)
 
         self.root.geometry("1000x800")
         self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
 
-        self.pdf_document = None
-        self.file_path = None
-        self.images_to_embed = []
-        self.text_to_embed = []
-        self.action_history = []
+        self.engine = PDFEditEngine()
+        self.autosave_interval_ms = 3000
+        self.compact_on_save = tk.BooleanVar(value=False)
+        self.linearize_on_save = tk.BooleanVar(value=False)
+        self._save_job = None  # the running background save, if any
+        self.reader_close_timeout = 5  # seconds to wait for workers to let go of a file being replaced
+
+        # Fast open: page sizes are checked in the background after the first paint
+        self.open_in_memory = tk.BooleanVar(value=False)
+        self.page_size_batch = 500
+        self.relayout_interval = 0.5  # seconds between scrollregion refinements
+        self._page_size_job = None
+        self._layout_stale = False
+        self._last_relayout = 0.0
+        self._open_started = None
+        self.first_paint_ms = None
+        self.overlay_items = {}  # annotation id -> (canvas item id, PhotoImage or None), visible pages only
+        self.overlay_layers = {}  # page_num -> (x, y, zoom) its overlay items were drawn at
         self.page_displays = []
-        self.page_layout_info = []
+        self.page_offsets = []
         self.current_page_num = 0
         self.zoom_level = 1.0
 
+        # Only pages near the viewport are rasterized; the rest stay as placeholders
+        self.virtual_rendering = True
+        self.prefetch_margin = 800  # canvas pixels rendered above/below the visible area
+        self.rendered_pages = set()
+        self._visible_render_id = None
+        self.render_scheduler = None
+        self.render_cache = RenderCache(max_bytes=512 * 1024 * 1024)
+        self.image_cache = ImageCache(max_bytes=128 * 1024 * 1024)
+
+        # Zoom shows a rescaled preview at once and re-renders after input goes idle
+        self.zoom_debounce_ms = 250
+        self._zoom_pending = False
+        self._zoom_debounce_id = None
+
+        # Pages larger than this many pixels are rendered as TILE_SIZE tiles around the viewport
+        self.tile_threshold_pixels = 8 * 1024 * 1024
+
         self.current_action = None
         self.pil_image_to_place = None
         self.resizing_rect_id = None
@@ -92,41 +138,85 @@ class PDFEditor:
 
         self.text_data_to_place = None
         self.text_preview_id = None
-
+        self._text_preview_font = None
+        self._text_extent_cache = {}
+
+        # Motion events are coalesced so previews update at most once per frame
+        self.frame_interval_ms = 16
+        self._pending_motion = None
+        self._motion_after_id = None
+        self._last_motion_update = 0.0
+        self._last_latency_report = 0.0
+        self.preview_latency = LatencyMeter()
+
+        # Tracing and the performance HUD (View menu); both are off by default
+        self.trace_enabled = tk.BooleanVar(value=tracer.enabled)
+        self.show_hud = tk.BooleanVar(value=False)
+        self.hud_interval_ms = 250
+        self.frame_latency = LatencyMeter(window=20)
+        self._hud_after_id = None
+        self._hud_expected = 0.0
+        self.time_to_window_ms = None
+
+        # Find: a text index is built in the background for every opened file
+        self.text_indexer = None
+        self._indexed_pages = 0
+        self._search_query = None
+        self._search_hits = []  # (page_num, word boxes in page points) in reading order
+        self._search_pos = -1
+        self._hits_by_page = {}
+
+        self._menu_labels = []  # (menu, index, translation key) of every labelled menu entry
         self._create_widgets()
+        self._create_menus()
         self._update_ui_text()
         self.update_ui_states()
+        self.root.bind("<Map>", self._on_window_mapped, add='+')
+        self.root.after(self.autosave_interval_ms, self._autosave)
 
     def _load_translations(self):
+        # Only the active language is loaded; see i18n.load_catalog
         try:
-            with open('translations.json', 'r', encoding='utf-8') as f:
-                self.translations = json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError) as e:
-            self.translations = {}
+            self.strings, self.languages = load_catalog(self.language)
+        except (OSError, ValueError) as e:
+            self.strings, self.languages = {}, []
             messagebox.showerror("Error", f"Could not load translations file: {e}")
 
     def _(self, key):
-        return self.translations.get(self.language, {}).get(key, key)
+        return self.strings.get(key, key)
 
     def _change_language(self, lang_code):
         self.language = lang_code
         self.language_var.set(lang_code)
+        self._load_translations()
         self._update_ui_text()
 
+    def _on_window_mapped(self, event):
+        if event.widget is not self.root or self.time_to_window_ms is not None:
+            return
+        now = time.perf_counter_ns()
+        self.time_to_window_ms = (now - STARTED_AT_NS) / 1e6
+        if tracer.enabled:
+            tracer.record('time_to_window', 'startup', STARTED_AT_NS, now)
+        if self.first_paint_ms is None:
+            self.latency_label.config(text=self._("time_to_window").format(self.time_to_window_ms))
+        # With the window up, the render processes start while the user picks a file
+        self.root.after_idle(start_render_processes)
+
     def _create_widgets(self):
         self.menubar = tk.Menu(self.root)
         self.root.config(menu=self.menubar)
 
-        # Create menus - they will be populated in _update_ui_text
+        # Create menus - they are populated in _create_menus
         self.file_menu = tk.Menu(self.menubar, tearoff=0)
         self.edit_menu = tk.Menu(self.menubar, tearoff=0)
         self.view_menu = tk.Menu(self.menubar, tearoff=0)
         self.language_menu = tk.Menu(self.menubar, tearoff=0)
 
-        self.menubar.add_cascade(label="File", menu=self.file_menu) # Placeholder label
-        self.menubar.add_cascade(label="Edit", menu=self.edit_menu)
-        self.menubar.add_cascade(label="View", menu=self.view_menu)
-        self.menubar.add_cascade(label="Language", menu=self.language_menu)
+        self._add_menu_item(self.menubar, 'cascade', "file_menu", menu=self.file_menu)
+        self._add_menu_item(self.menubar, 'cascade', "edit_menu", menu=self.edit_menu)
+        self._add_menu_item(self.menubar, 'cascade', "view_menu", menu=self.view_menu)
+        self._add_menu_item(self.menubar, 'cascade', "language_menu", menu=self.language_menu)
 
         # Toolbar
         toolbar = tk.Frame(self.root, bd=1, relief=tk.RAISED)
@@ -143,16 +233,33 @@ class PDFEditor:
 
         zoom_in_button = tk.Button(toolbar, text="+", command=lambda: self.zoom(1.2))
         zoom_in_button.pack(side=tk.LEFT, padx=2, pady=2)
+
+        # Find bar, packed right to left
+        self.search_status_label = tk.Label(toolbar, text="", anchor='w', width=24)
+        self.search_status_label.pack(side=tk.RIGHT, padx=2, pady=2)
+        find_next_button = tk.Button(toolbar, text="\u25bc", command=self.find_next)
+        find_next_button.pack(side=tk.RIGHT, padx=2, pady=2)
+        find_previous_button = tk.Button(toolbar, text="\u25b2", command=lambda: self.find_next(backwards=True))
+        find_previous_button.pack(side=tk.RIGHT, padx=2, pady=2)
+        self.find_entry = tk.Entry(toolbar, width=24)
+        self.find_entry.pack(side=tk.RIGHT, padx=2, pady=2)
+        self.find_entry.bind("<Return>", lambda event: self.find_next())
+        self.find_entry.bind("<Shift-Return>", lambda event: self.find_next(backwards=True))
+        self.find_entry.bind("<Escape>", lambda event: self._clear_search())
         toolbar.pack(side=tk.TOP, fill=tk.X)
 
         # Main Frame with Canvas and Scrollbar
         main_frame = tk.Frame(self.root)
         main_frame.pack(fill=tk.BOTH, expand=1)
 
+        self.show_thumbnails = tk.BooleanVar(value=True)
+        self.thumbnail_sidebar = ThumbnailSidebar(main_frame, self.go_to_page)
+        self.thumbnail_sidebar.frame.pack(side=tk.LEFT, fill=tk.Y)
+
         self.canvas = Canvas(main_frame, bg="#f0f0f0")
         self.v_scrollbar = Scrollbar(main_frame, orient=tk.VERTICAL, command=self.canvas.yview)
         self.h_scrollbar = Scrollbar(self.root, orient=tk.HORIZONTAL, command=self.canvas.xview)
-        self.canvas.config(yscrollcommand=self.v_scrollbar.set, xscrollcommand=self.h_scrollbar.set)
+        self.canvas.config(yscrollcommand=self._on_canvas_yscroll, xscrollcommand=self._on_canvas_xscroll)
 
         self.v_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         self.h_scrollbar.pack(side=tk.BOTTOM, fill=tk.X)
@@ -162,86 +269,116 @@ class PDFEditor:
         self.status_bar = tk.Frame(self.root, bd=1, relief=tk.SUNKEN)
         self.page_label = tk.Label(self.status_bar, text="", width=20)
         self.page_label.pack(side=tk.RIGHT, padx=2, pady=2)
+        self.hud_label = tk.Label(self.status_bar, text="", anchor='e', font=("Courier", 9))
+        self.latency_label = tk.Label(self.status_bar, text="", anchor='w')
+        self.latency_label.pack(side=tk.LEFT, padx=2, pady=2)
+        # Shown only while a background save runs
+        self.save_cancel_button = tk.Button(self.status_bar, text="", command=self.cancel_save)
+        self.save_progress_label = tk.Label(self.status_bar, text="", anchor='w')
         self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
         # Bindings
         control_key = "Command" if platform.system() == "Darwin" else "Control"
         self.root.bind(f"<{control_key}-z>", lambda event: self.undo_last_action())
+        self.root.bind(f"<{control_key}-y>", lambda event: self.redo_last_action())
+        self.root.bind(f"<{control_key}-Z>", lambda event: self.redo_last_action())
         self.root.bind(f"<{control_key}-plus>", lambda event: self.zoom(1.2))
         self.root.bind(f"<{control_key}-minus>", lambda event: self.zoom(0.8))
         self.root.bind(f"<{control_key}-0>", lambda event: self.reset_zoom())
-
-    def _update_ui_text(self):
-        self.root.title(self._("app_title"))
-
-        # --- Rebuild Menus --- #
-
-        # Update menubar cascade labels (indices are stable)
-        self.menubar.entryconfig(0, label=self._("file_menu"))
-        self.menubar.entryconfig(1, label=self._("edit_menu"))
-        self.menubar.entryconfig(2, label=self._("view_menu"))
-        self.menubar.entryconfig(3, label=self._("language_menu"))
-
-        # Rebuild File menu
-        self.file_menu.delete(0, tk.END)
-        self.file_menu.add_command(label=self._("open_pdf"), command=self.open_pdf)
-        self.file_menu.add_command(label=self._("save_pdf"), command=self._save_document)
-        self.file_menu.add_command(label=self._("save_as_pdf"), command=self._save_as_document)
+        self.root.bind(f"<{control_key}-f>", lambda event: self.focus_find())
+        self.canvas.bind("<Configure>", lambda event: self._schedule_visible_render())
+
+    def _add_menu_item(self, menu, kind, key, **options):
+        # Adds an entry and remembers its translation key, so that a language
+        # switch only has to relabel it
+        getattr(menu, f"add_{kind}")(label=self._(key), **options)
+        self._menu_labels.append((menu, menu.index(tk.END), key))
+
+    def _create_menus(self):
+        # File menu
+        self._add_menu_item(self.file_menu, 'command', "open_pdf", command=self.open_pdf)
+        self._add_menu_item(self.file_menu, 'command', "save_pdf", command=self._save_document)
+        self._add_menu_item(self.file_menu, 'command', "save_as_pdf", command=self._save_as_document)
+        self._add_menu_item(self.file_menu, 'checkbutton', "compact_on_save", variable=self.compact_on_save)
+        self._add_menu_item(self.file_menu, 'checkbutton', "linearize_on_save", variable=self.linearize_on_save)
+        self._add_menu_item(self.file_menu, 'checkbutton', "open_in_memory", variable=self.open_in_memory)
         self.file_menu.add_separator()
-        self.file_menu.add_command(label=self._("print_pdf"), command=self.print_pdf)
+        self._add_menu_item(self.file_menu, 'command', "print_pdf", command=self.print_pdf)
+        self._add_menu_item(self.file_menu, 'command', "export_pages", command=self.export_page_range)
+        self._add_menu_item(self.file_menu, 'command', "export_images", command=self.export_images)
         self.file_menu.add_separator()
-        self.file_menu.add_command(label=self._("exit_app"), command=self._on_closing)
+        self._add_menu_item(self.file_menu, 'command', "exit_app", command=self._on_closing)
 
-        # Rebuild Edit menu
-        self.edit_menu.delete(0, tk.END)
-        self.edit_menu.add_command(label=self._("undo"), command=self.undo_last_action)
+        # Edit menu
+        self._add_menu_item(self.edit_menu, 'command', "undo", command=self.undo_last_action)
+        self._add_menu_item(self.edit_menu, 'command', "redo", command=self.redo_last_action)
         self.edit_menu.add_separator()
-        self.edit_menu.add_command(label=self._("add_image"), command=self.toggle_image_placement)
-        self.edit_menu.add_command(label=self._("add_text"), command=self.toggle_text_placement)
+        self._add_menu_item(self.edit_menu, 'command', "add_image", command=self.toggle_image_placement)
+        self._add_menu_item(self.edit_menu, 'command', "add_text", command=self.toggle_text_placement)
         self.edit_menu.add_separator()
-        self.edit_menu.add_command(label=self._("cancel_action"), command=self.cancel_current_action)
-
-        # Rebuild View menu
-        self.view_menu.delete(0, tk.END)
-        self.view_menu.add_command(label=self._("zoom_in"), command=lambda: self.zoom(1.2))
-        self.view_menu.add_command(label=self._("zoom_out"), command=lambda: self.zoom(0.8))
-        self.view_menu.add_command(label=self._("zoom_reset"), command=self.reset_zoom)
-
-        # Rebuild Language menu
-        self.language_menu.delete(0, tk.END)
-        for lang_code in sorted(self.translations.keys()):
-            if isinstance(self.translations[lang_code], dict):
-                lang_name_key = f"lang_{lang_code}"
-                lang_name = self._(lang_name_key)
-                self.language_menu.add_radiobutton(
-                    label=lang_name,
-                    variable=self.language_var,
-                    value=lang_code,
-                    command=lambda lc=lang_code: self._change_language(lc)
-                )
+        self._add_menu_item(self.edit_menu, 'command', "cancel_action", command=self.cancel_current_action)
+        self.edit_menu.add_separator()
+        self._add_menu_item(self.edit_menu, 'command', "find_text", command=self.focus_find)
+
+        # View menu
+        self._add_menu_item(self.view_menu, 'command', "zoom_in", command=lambda: self.zoom(1.2))
+        self._add_menu_item(self.view_menu, 'command', "zoom_out", command=lambda: self.zoom(0.8))
+        self._add_menu_item(self.view_menu, 'command', "zoom_reset", command=self.reset_zoom)
+        self.view_menu.add_separator()
+        self._add_menu_item(self.view_menu, 'checkbutton', "show_thumbnails", variable=self.show_thumbnails,
+                            command=self._toggle_thumbnails)
+        self.view_menu.add_separator()
+        self._add_menu_item(self.view_menu, 'checkbutton', "record_trace", variable=self.trace_enabled,
+                            command=self._toggle_tracing)
+        self._add_menu_item(self.view_menu, 'checkbutton', "performance_hud", variable=self.show_hud,
+                            command=self._toggle_hud)
+        self._add_menu_item(self.view_menu, 'command', "export_trace", command=self.export_trace)
+
+        # Language menu
+        for lang_code in self.languages:
+            self._add_menu_item(self.language_menu, 'radiobutton', f"lang_{lang_code}",
+                                variable=self.language_var, value=lang_code,
+                                command=lambda lc=lang_code: self._change_language(lc))
+
+    def _update_ui_text(self):
+        self.root.title(self._("app_title"))
+
+        # Relabel the menus in place; they are only built once
+        for menu, index, key in self._menu_labels:
+            menu.entryconfig(index, label=self._(key))
 
         # Update toolbar buttons
         self.add_image_button.config(text=self._("add_image"))
         self.add_text_button.config(text=self._("add_text"))
+        self._update_search_status()
 
         # Update status bar
-        if self.pdf_document:
-            self.page_label.config(text=self._("page_status").format(self.current_page_num + 1, self.pdf_document.page_count))
+        if self.engine.document:
+            self.page_label.config(text=self._("page_status").format(self.current_page_num + 1, self.engine.document.page_count))
         else:
             self.page_label.config(text=self._("no_pdf_open"))
 
         self.update_ui_states()
 
     def update_ui_states(self):
-        base_state = tk.NORMAL if self.pdf_document else tk.DISABLED
+        base_state = tk.NORMAL if self.engine.document else tk.DISABLED
+        # Editing goes on during a background save, but nothing else may touch the file
+        file_state = tk.DISABLED if self._save_job else base_state
 
         # File Menu
-        self.file_menu.entryconfig(1, state=base_state)  # Save
-        self.file_menu.entryconfig(2, state=base_state)  # Save As
-        self.file_menu.entryconfig(4, state=base_state)  # Print
+        self.file_menu.entryconfig(0, state=tk.DISABLED if self._save_job else tk.NORMAL)  # Open
+        self.file_menu.entryconfig(1, state=file_state)  # Save
+        self.file_menu.entryconfig(2, state=file_state)  # Save As
+        self.file_menu.entryconfig(7, state=file_state)  # Print
+        self.file_menu.entryconfig(8, state=file_state)  # Export Pages
+        self.file_menu.entryconfig(9, state=file_state)  # Export Images
+        self.save_cancel_button.config(text=self._("cancel_save"))
 
         # Edit Menu
-        self.edit_menu.entryconfig(0, state=tk.NORMAL if self.action_history else tk.DISABLED) # Undo
+        self.edit_menu.entryconfig(0, state=tk.NORMAL if self.engine.annotations.can_undo else tk.DISABLED) # Undo
+        self.edit_menu.entryconfig(1, state=tk.NORMAL if self.engine.annotations.redo_stack else tk.DISABLED) # Redo
+        self.edit_menu.entryconfig(8, state=base_state)  # Find
+        self.find_entry.config(state=base_state)
 
         # View Menu (by index)
         self.view_menu.entryconfig(0, state=base_state)  # Zoom In
@@ -254,120 +391,637 @@ class PDFEditor:
         if self.current_action == 'image':
             self.add_image_button.config(text=self._("cancel"))
             self.add_text_button.config(state=tk.DISABLED)
-            self.edit_menu.entryconfig(3, state=tk.DISABLED)  # Add Text
-            self.edit_menu.entryconfig(2, label=self._("cancel_image_placement"))  # Add Image
+            self.edit_menu.entryconfig(4, state=tk.DISABLED)  # Add Text
+            self.edit_menu.entryconfig(3, label=self._("cancel_image_placement"))  # Add Image
         elif self.current_action == 'text':
             self.add_text_button.config(text=self._("cancel"))
             self.add_image_button.config(state=tk.DISABLED)
-            self.edit_menu.entryconfig(2, state=tk.DISABLED)  # Add Image
-            self.edit_menu.entryconfig(3, label=self._("cancel_text_placement"))  # Add Text
+            self.edit_menu.entryconfig(3, state=tk.DISABLED)  # Add Image
+            self.edit_menu.entryconfig(4, label=self._("cancel_text_placement"))  # Add Text
         else:
             self.add_image_button.config(text=self._("add_image"))
             self.add_text_button.config(text=self._("add_text"))
-            self.edit_menu.entryconfig(2, state=base_state, label=self._("add_image"))
-            self.edit_menu.entryconfig(3, state=base_state, label=self._("add_text"))
+            self.edit_menu.entryconfig(3, state=base_state, label=self._("add_image"))
+            self.edit_menu.entryconfig(4, state=base_state, label=self._("add_text"))
 
     def open_pdf(self):
         filepath = filedialog.askopenfilename(filetypes=[("PDF Files", "*.pdf")])
         if not filepath:
             return
+        self._open_started = time.perf_counter()
         try:
-            self.file_path = filepath
-            self.pdf_document = fitz.open(filepath)
+            self.engine.open(filepath, in_memory=self.open_in_memory.get())
+            if self.render_scheduler: self.render_scheduler.close()
+            self.render_scheduler = RenderScheduler(self.root, filepath, self._on_page_rendered,
+                                                    data=self.engine.file_data)
+            self.render_cache.clear()
+            self._clear_overlay_layers()
             self.current_page_num = 0
-            self.action_history = []
-            self.images_to_embed = []
-            self.text_to_embed = []
-            self.page_layout_info = [{'original_width': p.rect.width, 'original_height': p.rect.height} for p in self.pdf_document]
+            self._recover_unsaved_actions(filepath)
             self.display_pages()
             self.update_ui_states()
+            self._start_page_size_resolution()
+            self._start_file_caches()
         except Exception as e:
+            self._open_started = None
             messagebox.showerror(self._("error_title"), f"Failed to open PDF: {e}")
 
+    def _recover_unsaved_actions(self, filepath):
+        records = read_unsaved_actions(filepath)
+        if records and messagebox.askyesno(self._("recover_changes_title"),
+                                           self._("recover_changes_prompt").format(count=len(records))):
+            self.engine.replay_actions(records)
+        try:
+            self.engine.start_journal()
+        except OSError:
+            self.engine.stop_journal()  # autosave is best effort; editing still works without it
+
+    def _autosave(self):
+        # Only the actions since the last flush are written, so this stays cheap on huge files
+        if self.engine.journal and self.engine.journal.pending:
+            try:
+                self.engine.journal.flush()
+            except OSError:
+                self.engine.stop_journal()
+        self.root.after(self.autosave_interval_ms, self._autosave)
+
+    def _start_page_size_resolution(self):
+        if self._page_size_job is not None:
+            self.root.after_cancel(self._page_size_job)
+        self._layout_stale = False
+        self._last_relayout = time.perf_counter()
+        self._page_size_job = self.root.after(1, self._resolve_page_sizes)
+
+    def _resolve_page_sizes(self):
+        # One batch per event-loop turn so scrolling stays responsive meanwhile
+        self._page_size_job = None
+        if not self.engine.document:
+            return
+        if self.engine.resolve_page_sizes(self.page_size_batch):
+            self._layout_stale = True
+        pending = self.engine.page_sizes_pending
+        now = time.perf_counter()
+        if self._layout_stale and (not pending or now - self._last_relayout >= self.relayout_interval):
+            self._relayout_pages()
+            self._layout_stale = False
+            self._last_relayout = now
+        if pending:
+            self._page_size_job = self.root.after(1, self._resolve_page_sizes)
+
+    def _relayout_pages(self):
+        # Re-lays out the pages with their corrected sizes, keeping the page at the
+        # top of the window in place. Bitmaps come straight back from the cache.
+        top = self.canvas.canvasy(0)
+        anchor = max(0, find_offset_index(self.page_offsets, top))
+        within = (top - self.page_offsets[anchor]) / max(1, self.page_displays[anchor]['h'])
+        self.display_pages()
+        self._scroll_to_y(self.page_offsets[anchor] + within * self.page_displays[anchor]['h'])
+
+    def _scroll_region(self):
+        # The (x0, y0, x1, y1) that view fractions refer to, as set by display_pages.
+        # Not bbox("all"): overlays and search highlights may stick out of the pages.
+        region = self.canvas.tk.splitlist(self.canvas.cget('scrollregion'))
+        return tuple(float(value) for value in region) if region else None
+
+    def _scroll_to_y(self, y):
+        region_top, region_height = 0, 1
+        region = self._scroll_region()
+        if region:
+            region_top, region_height = region[1], max(1, region[3] - region[1])
+        self.canvas.yview_moveto((y - region_top) / region_height)
+        self._render_visible_pages()
+
+    def go_to_page(self, page_num):
+        if not self.page_displays: return
+        self._scroll_to_y(self.page_offsets[page_num] - 10)
+
+    def _toggle_tracing(self):
+        tracer.enabled = self.trace_enabled.get()
+        if not tracer.enabled and self.show_hud.get():
+            self.show_hud.set(False)
+            self._toggle_hud()
+
+    def _toggle_hud(self):
+        if self.show_hud.get():
+            # The HUD reads its numbers from the tracer
+            self.trace_enabled.set(True)
+            tracer.enabled = True
+            self.hud_label.pack(side=tk.RIGHT, padx=6, pady=2, before=self.page_label)
+            self.frame_latency.reset()
+            self._hud_expected = time.perf_counter() + self.hud_interval_ms / 1000
+            self._hud_after_id = self.root.after(self.hud_interval_ms, self._update_hud)
+        else:
+            if self._hud_after_id is not None:
+                self.root.after_cancel(self._hud_after_id)
+                self._hud_after_id = None
+            self.hud_label.pack_forget()
+
+    def _update_hud(self):
+        # How late this timer fires is how long the event loop was busy with other work
+        now = time.perf_counter()
+        self.frame_latency.record(max(0.0, now - self._hud_expected))
+        cache_bytes = self.render_cache.current_bytes + self.image_cache.variants.current_bytes
+        self.hud_label.config(text=self._("hud_text").format(
+            render=tracer.last_ms.get('render', 0.0), overlay=tracer.last_ms.get('overlay_redraw', 0.0),
+            lag=self.frame_latency.max_ms, cache=cache_bytes / (1024 * 1024)))
+        self._hud_expected = time.perf_counter() + self.hud_interval_ms / 1000
+        self._hud_after_id = self.root.after(self.hud_interval_ms, self._update_hud)
+
+    def export_trace(self):
+        save_path = filedialog.asksaveasfilename(defaultextension=".json", initialfile="xocopdf-trace.json",
+                                                 filetypes=[("Chrome Trace", "*.json")])
+        if not save_path: return
+        try:
+            count = tracer.export_chrome_trace(save_path)
+            messagebox.showinfo(self._("success_title"), self._("trace_exported").format(count=count, path=save_path))
+        except Exception as e:
+            messagebox.showerror(self._("error_title"), f"{self._('failed_to_export_trace')}: {e}")
+
+    def _start_file_caches(self):
+        # Thumbnails and the text index are both cached by file content; the
+        # hash is computed once, by whichever worker needs it first
+        digest = SharedDigest(self.engine.file_path, self.thumbnail_sidebar.cache.content_hash)
+        self.thumbnail_sidebar.load(self.engine.file_path, self.engine.page_count, data=self.engine.file_data,
+                                    digest=digest.get)
+        self._start_text_index(digest.get, data=self.engine.file_data)
+
+    def _start_text_index(self, digest, data=None):
+        if self.text_indexer: self.text_indexer.close()
+        self._clear_search()
+        self._indexed_pages = 0
+        self.text_indexer = TextIndexer(self.root, self.engine.file_path, self.engine.page_count,
+                                        self._on_index_progress, digest, data=data)
+        self._update_search_status()
+
+    def _on_index_progress(self, indexed, page_count):
+        if indexed == self._indexed_pages:
+            return
+        self._indexed_pages = indexed
+        if self._search_query is not None:
+            # Pages are indexed in order, so new hits only ever come after the current one
+            self._run_search(self._search_query)
+            self._draw_search_hits()
+        self._update_search_status()
+
+    def focus_find(self):
+        if not self.engine.document: return
+        self.find_entry.focus_set()
+        self.find_entry.select_range(0, tk.END)
+
+    def find_next(self, backwards=False):
+        if not self.text_indexer: return
+        query = self.find_entry.get().strip()
+        if not query:
+            self._clear_search()
+            return
+        if query != self._search_query:
+            self._search_query = query
+            self._run_search(query)
+            # Start from the page in view
+            self._search_pos = next((i for i, (page_num, _) in enumerate(self._search_hits)
+                                     if page_num >= self.current_page_num), 0)
+            if backwards:
+                self._search_pos -= 1
+        elif self._search_hits:
+            self._search_pos += -1 if backwards else 1
+        if self._search_hits:
+            self._search_pos %= len(self._search_hits)
+            self._show_search_hit()
+        self._update_search_status()
+
+    def _run_search(self, query):
+        with tracer.span('search', 'input', query=query):
+            self._search_hits = self.text_indexer.index.search(query)
+        self._hits_by_page = {}
+        for hit in self._search_hits:
+            self._hits_by_page.setdefault(hit[0], []).append(hit)
+
+    def _show_search_hit(self):
+        # Scrolls only when the hit is out of view; the visible pass then renders the target page
+        page_num, boxes = self._search_hits[self._search_pos]
+        page_info = self.page_displays[page_num]
+        x = page_info['x'] + boxes[0][0] * self.zoom_level
+        y = page_info['y'] + boxes[0][1] * self.zoom_level
+        region = self._scroll_region()
+        left, width = self.canvas.canvasx(0), self.canvas.winfo_width()
+        if region and not left <= x < left + width - 40:
+            self.canvas.xview_moveto(max(0, x - width / 3 - region[0]) / max(1, region[2] - region[0]))
+        top, height = self.canvas.canvasy(0), self.canvas.winfo_height()
+        if not top <= y < top + height - 40:
+            self._scroll_to_y(y - height / 3)
+        else:
+            self._draw_search_hits()
+
+    def _draw_search_hits(self, pages=None):
+        # Only hits on visible pages get canvas items
+        self.canvas.delete("search_hit")
+        if not self._hits_by_page or not self.page_displays:
+            return
+        current = self._search_hits[self._search_pos] if 0 <= self._search_pos < len(self._search_hits) else None
+        for page_num in pages if pages is not None else self._get_visible_page_range():
+            page_info = self.page_displays[page_num]
+            for hit in self._hits_by_page.get(page_num, ()):
+                color = "#e8590c" if hit is current else "#f0b400"
+                for x0, y0, x1, y1 in hit[1]:
+                    self.canvas.create_rectangle(page_info['x'] + x0 * self.zoom_level - 1,
+                                                 page_info['y'] + y0 * self.zoom_level - 1,
+                                                 page_info['x'] + x1 * self.zoom_level + 1,
+                                                 page_info['y'] + y1 * self.zoom_level + 1,
+                                                 outline=color, width=2, tags=("search_hit",))
+
+    def _clear_search(self):
+        self._search_query = None
+        self._search_hits = []
+        self._search_pos = -1
+        self._hits_by_page = {}
+        self.canvas.delete("search_hit")
+        self._update_search_status()
+
+    def _update_search_status(self):
+        parts = []
+        if self._search_query is not None:
+            if self._search_hits:
+                parts.append(self._("search_hit_status").format(current=self._search_pos + 1, total=len(self._search_hits)))
+            else:
+                parts.append(self._("search_no_matches"))
+        index = self.text_indexer.index if self.text_indexer else None
+        if index is not None and not index.complete:
+            parts.append(self._("search_indexing").format(percent=index.indexed * 100 // max(1, index.page_count)))
+        self.search_status_label.config(text=" \u00b7 ".join(parts))
+
+    def _toggle_thumbnails(self):
+        if self.show_thumbnails.get():
+            self.thumbnail_sidebar.frame.pack(side=tk.LEFT, fill=tk.Y, before=self.canvas)
+        else:
+            self.thumbnail_sidebar.frame.pack_forget()
+
+    @traced('layout', 'ui')
     def display_pages(self):
-        self.canvas.delete("all")
+        # Everything but the overlays is laid out again; the visible pass then
+        # moves and scales each page's overlay layer to the new layout
+        self.canvas.addtag_all("relayout")
+        self.canvas.dtag("overlay", "relayout")
+        self.canvas.delete("relayout")
         self.page_displays = []
+        self.page_offsets = []
+        self.rendered_pages = set()
+        self.text_preview_id = None  # deleted along with everything else
         y_offset = 10
+        canvas_width = self.canvas.winfo_width()
 
-        for i, page in enumerate(self.pdf_document):
-            w, h = self.page_layout_info[i]['original_width'], self.page_layout_info[i]['original_height']
-            render_width, render_height = int(w * self.zoom_level), int(h * self.zoom_level)
+        # Lay out every page as a cheap placeholder; pixels are rendered on demand
+        for i, info in enumerate(self.engine.page_layout_info):
+            render_width = int(info['original_width'] * self.zoom_level)
+            render_height = int(info['original_height'] * self.zoom_level)
 
-            pix = page.get_pixmap(matrix=fitz.Matrix(self.zoom_level, self.zoom_level))
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            tk_img = ImageTk.PhotoImage(image=img)
-
-            page_x = (self.canvas.winfo_width() - render_width) / 2
+            page_x = (canvas_width - render_width) / 2
             if page_x < 10: page_x = 10
 
-            self.canvas.create_image(page_x, y_offset, anchor='nw', image=tk_img)
-            self.page_displays.append({'image': tk_img, 'x': page_x, 'y': y_offset, 'w': render_width, 'h': render_height, 'page_num': i})
+            placeholder_id = self.canvas.create_rectangle(page_x, y_offset, page_x + render_width, y_offset + render_height,
+                                                          fill="#d9d9d9", outline="#c0c0c0", tags=("placeholder",))
+            self.page_displays.append({'image': None, 'image_id': None, 'source': None, 'exact': False,
+                                       'tiles': {}, 'placeholder_id': placeholder_id,
+                                       'x': page_x, 'y': y_offset, 'w': render_width, 'h': render_height, 'page_num': i})
+            self.page_offsets.append(y_offset)
             y_offset += render_height + 10
 
-        self.canvas.config(scrollregion=self.canvas.bbox("all"))
-        self._redraw_embedded_objects()
+        self.canvas.config(scrollregion=self.canvas.bbox("placeholder"))
+        self.canvas.tag_raise("overlay")
+        self._render_visible_pages()
         self._update_page_display()
 
-    def _redraw_embedded_objects(self):
-        for item in self.images_to_embed:
+    def _on_canvas_yscroll(self, first, last):
+        self.v_scrollbar.set(first, last)
+        self._schedule_visible_render()
+
+    def _on_canvas_xscroll(self, first, last):
+        self.h_scrollbar.set(first, last)
+        self._schedule_visible_render()
+
+    def _schedule_visible_render(self):
+        # Coalesce bursts of scroll/resize events into a single render pass
+        if self._visible_render_id is None and self.page_displays:
+            self._visible_render_id = self.root.after_idle(self._render_visible_pages)
+
+    def _get_visible_page_range(self, margin=0):
+        if not self.virtual_rendering:
+            return range(len(self.page_displays))
+        top = self.canvas.canvasy(0) - margin
+        bottom = self.canvas.canvasy(self.canvas.winfo_height()) + margin
+        first = max(0, find_offset_index(self.page_offsets, top))
+        if self.page_offsets[first] + self.page_displays[first]['h'] < top:
+            first += 1  # top falls in the gap below this page
+        last = find_offset_index(self.page_offsets, bottom)
+        return range(first, last + 1)
+
+    @traced('visible_pass', 'ui')
+    def _render_visible_pages(self):
+        if self._visible_render_id is not None:
+            self.root.after_cancel(self._visible_render_id)
+            self._visible_render_id = None
+        if not self.engine.document or not self.page_displays:
+            return
+
+        visible = self._get_visible_page_range()
+        wanted = self._get_visible_page_range(self.prefetch_margin)
+
+        # The page in the middle of the window is the current one
+        center_page = max(0, find_offset_index(self.page_offsets, self.canvas.canvasy(self.canvas.winfo_height() / 2)))
+        if center_page != self.current_page_num:
+            self.current_page_num = center_page
+            self._update_page_display()
+            self.thumbnail_sidebar.set_current_page(center_page)
+
+        # Evict pages that scrolled out of range
+        for page_num in [p for p in self.rendered_pages if p not in wanted]:
+            self._evict_page(self.page_displays[page_num])
+
+        # Visible pages first, then the prefetch margin ordered by distance from the viewport
+        center = (visible.start + visible.stop) / 2 if visible else 0
+        order = list(visible) + sorted((p for p in wanted if p not in visible), key=lambda p: abs(p - center))
+        render_zoom = self._render_zoom()
+        keys = []
+        for page_num in order:
+            page_info = self.page_displays[page_num]
+            if self._is_tiled(page_info):
+                keys += self._update_page_tiles(page_info, render_zoom)
+                continue
+            if page_info['exact']:
+                continue
+            cached = self.render_cache.get((page_num, render_zoom, None))
+            if cached:
+                self._show_page_image(page_info, cached[1], cached[0])
+            else:
+                keys.append((page_num, render_zoom, None))
+
+        # While a zoom is still settling only cached renders are shown; anything
+        # queued for the previous zoom level is dropped.
+        self.render_scheduler.schedule([] if self._zoom_pending else keys)
+        self._update_overlay_layers(visible)
+        if self._hits_by_page:
+            self._draw_search_hits(visible)
+
+    def _is_tiled(self, page_info):
+        return page_info['w'] * page_info['h'] > self.tile_threshold_pixels
+
+    def _update_page_tiles(self, page_info, render_zoom):
+        # Work out which tiles of this page fall inside the (prefetch-extended) viewport
+        margin = self.prefetch_margin
+        left = max(0, self.canvas.canvasx(0) - margin - page_info['x'])
+        right = min(page_info['w'], self.canvas.canvasx(self.canvas.winfo_width()) + margin - page_info['x'])
+        top = max(0, self.canvas.canvasy(0) - margin - page_info['y'])
+        bottom = min(page_info['h'], self.canvas.canvasy(self.canvas.winfo_height()) + margin - page_info['y'])
+        wanted = set()
+        if left < right and top < bottom:
+            wanted = {(col, row)
+                      for col in range(int(left // TILE_SIZE), int((right - 1) // TILE_SIZE) + 1)
+                      for row in range(int(top // TILE_SIZE), int((bottom - 1) // TILE_SIZE) + 1)}
+
+        tiles = page_info['tiles']
+        for tile in [t for t in tiles if t not in wanted]:
+            self.canvas.delete(tiles.pop(tile)[0])
+
+        # Tiles nearest the middle of the viewport first
+        center_x = (self.canvas.canvasx(0) + self.canvas.winfo_width() / 2 - page_info['x']) / TILE_SIZE
+        center_y = (self.canvas.canvasy(0) + self.canvas.winfo_height() / 2 - page_info['y']) / TILE_SIZE
+        keys = []
+        for tile in sorted(wanted, key=lambda t: (t[0] + 0.5 - center_x) ** 2 + (t[1] + 0.5 - center_y) ** 2):
+            if tile in tiles:
+                continue
+            key = (page_info['page_num'], render_zoom, tile)
+            cached = self.render_cache.get(key)
+            if cached:
+                self._show_page_tile(page_info, tile, cached[1])
+            else:
+                keys.append(key)
+        return keys
+
+    def _show_page_tile(self, page_info, tile, tk_img):
+        col, row = tile
+        image_id = self.canvas.create_image(page_info['x'] + col * TILE_SIZE, page_info['y'] + row * TILE_SIZE,
+                                            anchor='nw', image=tk_img, tags=("page",))
+        self.canvas.tag_raise(image_id, page_info['placeholder_id'])
+        page_info['tiles'][tile] = (image_id, tk_img)
+        self.rendered_pages.add(page_info['page_num'])
+
+    def _render_zoom(self):
+        # Rounded so that zooming back to a level hits the same cache entries
+        return round(self.zoom_level, 4)
+
+    def _on_page_rendered(self, key, width, height, ppm):
+        # The PPM bytes are kept as the page's source for rescaled zoom previews
+        with tracer.span('photoimage', 'render'):
+            tk_img = ppm_photo_image(ppm, master=self.canvas)
+        self.render_cache.put(key, (ppm, tk_img), len(ppm) + photo_image_nbytes(width, height))
+
+        page_num, zoom_level, tile = key
+        if zoom_level != self._render_zoom() or page_num >= len(self.page_displays):
+            return
+        page_info = self.page_displays[page_num]
+        if tile is not None:
+            if self._is_tiled(page_info) and tile not in page_info['tiles']:
+                self._show_page_tile(page_info, tile, tk_img)
+        elif not page_info['exact']:
+            self._show_page_image(page_info, tk_img, ppm)
+
+        if self._open_started is not None and page_num in self._get_visible_page_range():
+            # Time from picking the file to the first page pixels on screen
+            self.first_paint_ms = (time.perf_counter() - self._open_started) * 1000
+            self._open_started = None
+            self.latency_label.config(text=self._("first_paint").format(self.first_paint_ms))
+
+    def _show_page_image(self, page_info, tk_img, source, exact=True):
+        if page_info['image_id'] is not None:
+            self.canvas.delete(page_info['image_id'])
+        image_id = self.canvas.create_image(page_info['x'], page_info['y'], anchor='nw', image=tk_img, tags=("page",))
+        # Keep the page bitmap directly above its placeholder, below any overlays
+        self.canvas.tag_raise(image_id, page_info['placeholder_id'])
+        page_info['image'] = tk_img
+        page_info['image_id'] = image_id
+        page_info['source'] = source
+        page_info['exact'] = exact
+        self.rendered_pages.add(page_info['page_num'])
+
+    def _evict_page(self, page_info):
+        if page_info['image_id'] is not None:
+            self.canvas.delete(page_info['image_id'])
+        page_info['image'] = None
+        page_info['image_id'] = None
+        page_info['source'] = None
+        page_info['exact'] = False
+        for image_id, _ in page_info['tiles'].values():
+            self.canvas.delete(image_id)
+        page_info['tiles'] = {}
+        self.rendered_pages.discard(page_info['page_num'])
+
+    @staticmethod
+    def _overlay_tag(page_num):
+        return f"overlay_p{page_num}"
+
+    @traced('overlay_redraw', 'overlay')
+    def _update_overlay_layers(self, visible):
+        # Each page's overlays share one canvas tag, and only visible pages have
+        # any. Layers that scrolled away are dropped, new ones drawn, and moved
+        # or zoomed pages are transformed as a group instead of being redrawn.
+        for page_num in [p for p in self.overlay_layers if p not in visible]:
+            self._drop_overlay_layer(page_num)
+        for page_num in visible:
+            page_info = self.page_displays[page_num]
+            layer = self.overlay_layers.get(page_num)
+            if layer is None:
+                self.overlay_layers[page_num] = (page_info['x'], page_info['y'], self.zoom_level)
+                items = self.engine.annotations.on_page(page_num)
+                # Text stays above images
+                for item in sorted(items, key=lambda item: item.kind == 'text'):
+                    self._draw_embedded_item(item)
+            elif layer != (page_info['x'], page_info['y'], self.zoom_level):
+                self._transform_overlay_layer(page_num, *layer)
+
+    def _transform_overlay_layer(self, page_num, x, y, zoom):
+        page_info = self.page_displays[page_num]
+        tag = self._overlay_tag(page_num)
+        if zoom != self.zoom_level:
+            factor = self.zoom_level / zoom
+            self.canvas.scale(tag, x, y, factor, factor)
+            # Scaling moves the anchors; fonts and bitmaps are resized here
+            for item in self.engine.annotations.on_page(page_num):
+                canvas_item = self.overlay_items.get(item.id)
+                if canvas_item is None: continue
+                if item.kind == 'image':
+                    tk_img = self.image_cache.get(item.path, self._overlay_image_size(item), high_quality=not self._zoom_pending)
+                    self.canvas.itemconfig(canvas_item[0], image=tk_img)
+                    self.overlay_items[item.id] = (canvas_item[0], tk_img)
+                else:
+                    self.canvas.itemconfig(canvas_item[0], font=self._overlay_font(item))
+        self.canvas.move(tag, page_info['x'] - x, page_info['y'] - y)
+        self.overlay_layers[page_num] = (page_info['x'], page_info['y'], self.zoom_level)
+
+    def _drop_overlay_layer(self, page_num):
+        del self.overlay_layers[page_num]
+        self.canvas.delete(self._overlay_tag(page_num))
+        for item in self.engine.annotations.on_page(page_num):
+            self.overlay_items.pop(item.id, None)
+
+    def _clear_overlay_layers(self):
+        self.canvas.delete("overlay")
+        self.overlay_items = {}
+        self.overlay_layers = {}
+
+    def _draw_embedded_item(self, item):
+        # Pages without a layer get their overlays once they scroll into view
+        if item.page_num not in self.overlay_layers:
+            return
+        if item.kind == 'image':
             self._draw_embedded_image(item)
-        for item in self.text_to_embed:
+        else:
             self._draw_embedded_text(item)
 
     def _draw_embedded_image(self, item):
-        page_info = self.page_displays[item['page_num']]
-        x = page_info['x'] + item['rel_x'] * self.zoom_level
-        y = page_info['y'] + item['rel_y'] * self.zoom_level
-        w = item['rel_w'] * self.zoom_level
-        h = item['rel_h'] * self.zoom_level
+        page_info = self.page_displays[item.page_num]
+        x = page_info['x'] + item.rel_x * self.zoom_level
+        y = page_info['y'] + item.rel_y * self.zoom_level
+
+        # Cheap resampling while a zoom is settling; _finish_zoom swaps in the sharp version
+        tk_img = self.image_cache.get(item.path, self._overlay_image_size(item), high_quality=not self._zoom_pending)
 
-        pil_img = Image.open(item['path'])
-        pil_img = pil_img.resize((int(w), int(h)), Image.LANCZOS)
-        tk_img = ImageTk.PhotoImage(image=pil_img)
+        img_id = self.canvas.create_image(x, y, anchor='nw', image=tk_img,
+                                          tags=("overlay", self._overlay_tag(item.page_num)))
+        self.overlay_items[item.id] = (img_id, tk_img)
 
-        img_id = self.canvas.create_image(x, y, anchor='nw', image=tk_img)
-        item['canvas_image_ref'] = tk_img
-        item['canvas_id'] = img_id
+    def _overlay_image_size(self, item):
+        return int(item.rel_w * self.zoom_level), int(item.rel_h * self.zoom_level)
+
+    def _overlay_font(self, item):
+        return (item.font, int(item.size * self.zoom_level * (72/96)))
+
+    @traced('overlay_refresh', 'overlay')
+    def _refresh_overlay_images(self):
+        for annotation_id, (img_id, tk_img) in list(self.overlay_items.items()):
+            if tk_img is None: continue  # text
+            item = self.engine.annotations.get(annotation_id)
+            tk_img = self.image_cache.get(item.path, self._overlay_image_size(item))
+            self.canvas.itemconfig(img_id, image=tk_img)
+            self.overlay_items[annotation_id] = (img_id, tk_img)
 
     def _draw_embedded_text(self, item):
-        page_info = self.page_displays[item['page_num']]
-        x = page_info['x'] + item['rel_x'] * self.zoom_level
-        y = page_info['y'] + item['rel_y'] * self.zoom_level
-        
-        font_size_canvas = int(item['size'] * self.zoom_level * (72/96))
+        page_info = self.page_displays[item.page_num]
+        x = page_info['x'] + item.rel_x * self.zoom_level
+        y = page_info['y'] + item.rel_y * self.zoom_level
 
-        text_id = self.canvas.create_text(x, y, text=item['text'], 
-                                          font=(item['font'], font_size_canvas), 
-                                          fill=item['hex_color'], anchor='nw')
-        item['canvas_id'] = text_id
+        text_id = self.canvas.create_text(x, y, text=item.text,
+                                          font=self._overlay_font(item),
+                                          fill=item.hex_color, anchor='nw',
+                                          tags=("overlay", self._overlay_tag(item.page_num)))
+        self.overlay_items[item.id] = (text_id, None)
 
     def _update_page_display(self):
-        if self.pdf_document:
-            page_text = self._("page_display").format(page_num=self.current_page_num + 1, total_pages=self.pdf_document.page_count)
+        if self.engine.document:
+            page_text = self._("page_display").format(page_num=self.current_page_num + 1, total_pages=self.engine.document.page_count)
             self.page_label.config(text=page_text)
         else:
             page_text = self._("page_display").format(page_num=0, total_pages=0)
             self.page_label.config(text=page_text)
 
     def zoom(self, factor):
-        if not self.pdf_document: return
-        self.zoom_level *= factor
-        self.zoom_label.config(text=f"{int(self.zoom_level * 100)}%")
-        self.display_pages()
+        if not self.engine.document: return
+        self._set_zoom(self.zoom_level * factor)
 
     def reset_zoom(self):
-        if not self.pdf_document: return
-        self.zoom_level = 1.0
-        self.zoom_label.config(text="100%")
-        self.display_pages()
+        if not self.engine.document: return
+        self._set_zoom(1.0)
+
+    def _set_zoom(self, zoom_level):
+        # Phase one: lay out at the new zoom and stretch the bitmaps already on screen
+        sources = {p: self.page_displays[p]['source'] for p in self.rendered_pages}
+        y_fraction = self.canvas.yview()[0]
 
+        self.zoom_level = zoom_level
+        self.zoom_label.config(text=f"{int(self.zoom_level * 100)}%")
+        self._zoom_pending = True
+        self.display_pages()
+        self.canvas.yview_moveto(y_fraction)
+
+        for page_num in self._get_visible_page_range():
+            page_info = self.page_displays[page_num]
+            source = sources.get(page_num)
+            # Stretching a full-page bitmap up to tiled sizes would defeat tiling
+            if page_info['exact'] or source is None or self._is_tiled(page_info):
+                continue
+            preview = ppm_to_image(source).resize((page_info['w'], page_info['h']), Image.NEAREST)
+            self._show_page_image(page_info, ImageTk.PhotoImage(image=preview), source, exact=False)
+
+        # Phase two: render crisp pages once zoom input has been idle for a moment
+        if self._zoom_debounce_id is not None:
+            self.root.after_cancel(self._zoom_debounce_id)
+        self._zoom_debounce_id = self.root.after(self.zoom_debounce_ms, self._finish_zoom)
+
+    def _finish_zoom(self):
+        self._zoom_debounce_id = None
+        self._zoom_pending = False
+        self._refresh_overlay_images()
+        self._render_visible_pages()
+
+    @traced('hit_test_page', 'input')
     def get_page_at_coords(self, canvas_x, canvas_y):
-        for page_info in self.page_displays:
-            if page_info['x'] <= canvas_x <= page_info['x'] + page_info['w'] and \
-               page_info['y'] <= canvas_y <= page_info['y'] + page_info['h']:
-                return page_info
+        # Pages are stacked vertically, so a binary search on their top edges finds the candidate
+        index = find_offset_index(self.page_offsets, canvas_y)
+        if index < 0:
+            return None
+        page_info = self.page_displays[index]
+        if page_info['x'] <= canvas_x <= page_info['x'] + page_info['w'] and \
+           page_info['y'] <= canvas_y <= page_info['y'] + page_info['h']:
+            return page_info
         return None
 
+    @traced('hit_test_overlay', 'input')
+    def get_overlay_at_coords(self, canvas_x, canvas_y):
+        page_info = self.get_page_at_coords(canvas_x, canvas_y)
+        if not page_info:
+            return None
+        return self.engine.overlay_at(page_info['page_num'],
+                                      (canvas_x - page_info['x']) / self.zoom_level,
+                                      (canvas_y - page_info['y']) / self.zoom_level)
+
     def toggle_image_placement(self):
         if self.current_action == 'image':
             self.cancel_current_action()
@@ -381,6 +1035,7 @@ class PDFEditor:
 
         try:
             self.pil_image_to_place = Image.open(filepath)
+            self.preview_latency.reset()
             self.current_action = 'image'
             self.root.title(self._("main_title") + f" - {self._('place_image_prompt')}")
             self.canvas.config(cursor="crosshair")
@@ -403,6 +1058,7 @@ class PDFEditor:
         if not dialog.result: return
 
         self.text_data_to_place = dialog.result
+        self.preview_latency.reset()
         self.current_action = 'text'
         self.root.title(self._("main_title") + f" - {self._('place_text_prompt')}")
         self.canvas.config(cursor="tcross")
@@ -421,8 +1077,15 @@ class PDFEditor:
         self.canvas.unbind("<Enter>")
         self.canvas.unbind("<Leave>")
 
+        if self._motion_after_id is not None:
+            self.root.after_cancel(self._motion_after_id)
+            self._motion_after_id = None
+        self._pending_motion = None
+
         if self.resizing_rect_id: self.canvas.delete(self.resizing_rect_id)
-        self.clear_text_preview()
+        if self.text_preview_id:
+            self.canvas.delete(*self.text_preview_id)
+            self.text_preview_id = None
 
         self.pil_image_to_place = None
         self.resizing_rect_id = None
@@ -439,9 +1102,37 @@ class PDFEditor:
         self.resizing_rect_id = self.canvas.create_rectangle(self.start_x, self.start_y, self.start_x, self.start_y, outline='red', dash=(4, 4))
 
     def do_resize(self, event):
-        cur_x, cur_y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
+        self._queue_motion(self._move_rubber_band, event)
+
+    def _move_rubber_band(self, cur_x, cur_y):
         self.canvas.coords(self.resizing_rect_id, self.start_x, self.start_y, cur_x, cur_y)
 
+    def _queue_motion(self, handler, event):
+        # Keep only the latest position and apply it on the next frame boundary
+        self._pending_motion = (handler, event.x, event.y)
+        if self._motion_after_id is not None:
+            return
+        elapsed_ms = (time.perf_counter() - self._last_motion_update) * 1000
+        delay = max(0, int(self.frame_interval_ms - elapsed_ms))
+        self._motion_after_id = self.root.after(delay, self._flush_motion)
+
+    @traced('motion_frame', 'input')
+    def _flush_motion(self):
+        self._motion_after_id = None
+        if self._pending_motion is None: return
+        handler, x, y = self._pending_motion
+        self._pending_motion = None
+
+        start = time.perf_counter()
+        handler(self.canvas.canvasx(x), self.canvas.canvasy(y))
+        self._last_motion_update = time.perf_counter()
+        self.preview_latency.record(self._last_motion_update - start)
+
+        if self._last_motion_update - self._last_latency_report > 0.5:
+            self._last_latency_report = self._last_motion_update
+            self.latency_label.config(text=self._("preview_latency").format(
+                last=self.preview_latency.last_ms, avg=self.preview_latency.avg_ms, max=self.preview_latency.max_ms))
+
     def end_resize(self, event):
         end_x, end_y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
         
@@ -461,38 +1152,52 @@ class PDFEditor:
             self.cancel_current_action()
             return
 
-        image_data = {
-            'type': 'image',
-            'path': self.pil_image_to_place.filename,
-            'page_num': target_page_info['page_num'],
-            'rel_x': rel_x, 'rel_y': rel_y, 'rel_w': rel_w, 'rel_h': rel_h
-        }
-
-        self.images_to_embed.append(image_data)
-        self.action_history.append({'type': 'image', 'data': image_data})
-        self._draw_embedded_image(image_data)
+        image_data = self.engine.add_image(target_page_info['page_num'], self.pil_image_to_place.filename,
+                                           rel_x, rel_y, rel_w, rel_h)
+        self._draw_embedded_item(image_data)
         self.cancel_current_action()
 
     def update_text_preview(self, event):
-        self.clear_text_preview()
-        if not self.text_data_to_place: return
+        self._queue_motion(self._move_text_preview, event)
 
-        canvas_x, canvas_y = self.canvas.canvasx(event.x), self.canvas.canvasy(event.y)
-        font_size_canvas = int(self.text_data_to_place['size'] * self.zoom_level * (72/96))
-
-        text_id = self.canvas.create_text(canvas_x, canvas_y, text=self.text_data_to_place['text'],
-                                          font=(self.text_data_to_place['font'], font_size_canvas),
-                                          fill=self.text_data_to_place['hex_color'], anchor='nw')
-        bbox = self.canvas.bbox(text_id)
-        if bbox:
-            rect_id = self.canvas.create_rectangle(bbox, dash=(4, 4), outline='gray')
+    def _move_text_preview(self, canvas_x, canvas_y):
+        if not self.text_data_to_place: return
+        data = self.text_data_to_place
+        font = (data['font'], int(data['size'] * self.zoom_level * (72/96)))
+
+        # The preview items are created once per placement and then only moved
+        if self.text_preview_id is None:
+            text_id = self.canvas.create_text(canvas_x, canvas_y, text=data['text'], font=font,
+                                              fill=data['hex_color'], anchor='nw')
+            rect_id = self.canvas.create_rectangle(canvas_x, canvas_y, canvas_x, canvas_y, dash=(4, 4), outline='gray')
             self.text_preview_id = (text_id, rect_id)
-
-    def clear_text_preview(self):
+            self._text_preview_font = font
+        text_id, rect_id = self.text_preview_id
+        if font != self._text_preview_font:
+            self.canvas.itemconfig(text_id, font=font)
+            self._text_preview_font = font
+
+        self.canvas.itemconfig(text_id, state='normal')
+        self.canvas.itemconfig(rect_id, state='normal')
+        self.canvas.coords(text_id, canvas_x, canvas_y)
+        x0, y0, x1, y1 = self._text_extent(text_id, data['text'], font, canvas_x, canvas_y)
+        self.canvas.coords(rect_id, canvas_x + x0, canvas_y + y0, canvas_x + x1, canvas_y + y1)
+
+    def _text_extent(self, text_id, text, font, canvas_x, canvas_y):
+        # Bounding box relative to the anchor point, measured once per text and font
+        key = (text, font)
+        extent = self._text_extent_cache.get(key)
+        if extent is None:
+            bbox = self.canvas.bbox(text_id) or (canvas_x, canvas_y, canvas_x, canvas_y)
+            extent = (bbox[0] - canvas_x, bbox[1] - canvas_y, bbox[2] - canvas_x, bbox[3] - canvas_y)
+            self._text_extent_cache[key] = extent
+        return extent
+
+    def clear_text_preview(self, event=None):
+        self._pending_motion = None
         if self.text_preview_id:
-            self.canvas.delete(self.text_preview_id[0])
-            self.canvas.delete(self.text_preview_id[1])
-            self.text_preview_id = None
+            for item_id in self.text_preview_id:
+                self.canvas.itemconfig(item_id, state='hidden')
 
     def finalize_text_placement(self, event):
         if not self.text_data_to_place: return
@@ -508,98 +1213,196 @@ class PDFEditor:
         rel_x = (canvas_x - target_page_info['x']) / self.zoom_level
         rel_y = (canvas_y - target_page_info['y']) / self.zoom_level
 
-        final_text_data = self.text_data_to_place.copy()
-        final_text_data.update({
-            'page_num': target_page_info['page_num'], 
-            'rel_x': rel_x, 'rel_y': rel_y
-        })
-
-        self.text_to_embed.append(final_text_data)
-        self.action_history.append({'type': 'text', 'data': final_text_data})
+        data = self.text_data_to_place
+        final_text_data = self.engine.add_text(target_page_info['page_num'], rel_x, rel_y, data['text'],
+                                               font=data['font'], size=data['size'], color=data['color'])
         self.cancel_current_action()
-        self._draw_embedded_text(final_text_data)
-
-    def undo_last_action(self):
-        if not self.action_history: return
-
-        last_action = self.action_history.pop()
-        if last_action['type'] == 'image':
-            removed_item = self.images_to_embed.pop()
-            if 'canvas_id' in removed_item: self.canvas.delete(removed_item['canvas_id'])
-        elif last_action['type'] == 'text':
-            removed_item = self.text_to_embed.pop()
-            if 'canvas_id' in removed_item: self.canvas.delete(removed_item['canvas_id'])
-        
+        self._draw_embedded_item(final_text_data)
+
+    def undo_last_action(self, annotation_id=None):
+        removed_item = self.engine.undo(annotation_id)
+        if removed_item is None: return
+
+        canvas_item = self.overlay_items.pop(removed_item.id, None)
+        if canvas_item: self.canvas.delete(canvas_item[0])
+        self.update_ui_states()
+
+    def redo_last_action(self):
+        if not self.page_displays: return
+        restored_item = self.engine.redo()
+        if restored_item is None: return
+
+        self._draw_embedded_item(restored_item)
         self.update_ui_states()
 
-    def _save_document(self):
-        if not self.file_path:
-            return self._save_as_document()
-        return self._perform_save(self.file_path)
+    def _save_document(self, on_success=None):
+        if not self.engine.file_path:
+            return self._save_as_document(on_success)
+        return self._perform_save(self.engine.file_path, on_success=on_success)
 
-    def _save_as_document(self):
-        if not self.pdf_document: return False
+    def _save_as_document(self, on_success=None):
+        if not self.engine.document: return False
         save_path = filedialog.asksaveasfilename(
             defaultextension=".pdf",
             filetypes=[("PDF Files", "*.pdf")]
         )
         if not save_path: return False
-        return self._perform_save(save_path)
+        return self._perform_save(save_path, on_success=on_success)
+
+    def _perform_save(self, save_path, on_success=None):
+        # Saves a snapshot of the current placements on a worker thread, so editing
+        # can go on meanwhile. Returns whether the save was started; on_success is
+        # called on the Tk thread once the file is written.
+        if self._save_job: return False
+        snapshot = self.engine.snapshot()
+        job = {
+            'thread': None, 'cancel': threading.Event(), 'progress': (0, 0),
+            'saved_ids': snapshot.annotations.history_ids(), 'written_ids': snapshot.annotations.ids(),
+            'path': save_path, 'on_success': on_success,
+        }
+        compact = self.compact_on_save.get()
+        linearize = self.linearize_on_save.get()
+        same_file = os.path.abspath(save_path) == os.path.abspath(self.engine.file_path)
+
+        def on_page(done, total):
+            job['progress'] = (done, total)
+
+        def run():
+            try:
+                # A new version of the open file is moved into place on the Tk thread (see _poll_save)
+                job['temp_path'] = snapshot.save(save_path, compact=compact, linearize=linearize, on_page=on_page,
+                                                 cancel_event=job['cancel'], replace=not same_file)
+            except SaveCancelled:
+                job['cancelled'] = True
+            except Exception as e:
+                job['error'] = e
+
+        job['thread'] = threading.Thread(target=run, daemon=True)
+        self._save_job = job
+        job['thread'].start()
+        self.save_progress_label.pack(side=tk.LEFT, padx=2, pady=2)
+        self.save_cancel_button.pack(side=tk.LEFT, padx=2, pady=1)
+        self.update_ui_states()
+        self._poll_save()
+        return True
+
+    def cancel_save(self):
+        if self._save_job:
+            self._save_job['cancel'].set()
+
+    def _poll_save(self):
+        job = self._save_job
+        if job['thread'].is_alive():
+            done, total = job['progress']
+            text = self._("saving_pages").format(done=done, total=total) if done < total else self._("saving_writing")
+            self.save_progress_label.config(text=text)
+            self.root.after(100, self._poll_save)
+            return
 
-    def _perform_save(self, save_path, is_temporary_save=False):
-        try:
-            doc = fitz.open(self.file_path)
-
-            for item in self.images_to_embed:
-                page = doc.load_page(item['page_num'])
-                rect = fitz.Rect(item['rel_x'], item['rel_y'], 
-                                 item['rel_x'] + item['rel_w'], 
-                                 item['rel_y'] + item['rel_h'])
-                page.insert_image(rect, filename=item['path'])
-
-            for item in self.text_to_embed:
-                page = doc.load_page(item['page_num'])
-                point = fitz.Point(item['rel_x'], item['rel_y'] + item['size'])
-                page.insert_text(point, item['text'], 
-                                  fontname=item['font'].lower(), 
-                                  fontsize=item['size'], 
-                                  color=item['color'])
-
-            if save_path == self.file_path:
-                doc.save(save_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP)
+        self._save_job = None
+        self.save_progress_label.pack_forget()
+        self.save_cancel_button.pack_forget()
+        succeeded = 'error' not in job and not job.get('cancelled')
+        if succeeded and job.get('temp_path'):
+            # Windows cannot replace the open file while anything still reads it
+            self._close_file_readers()
+            try:
+                self.engine.replace_file(job['temp_path'], job['path'])
+            except OSError as e:
+                job['error'] = e
+                succeeded = False
+                if not isinstance(e, ReplaceFailed):
+                    self._reload_saved_file(())
+                # Otherwise the file on disk may be incomplete; the error names the complete copy
+        if succeeded:
+            # Only what the snapshot held is saved; later edits stay undoable
+            if os.path.abspath(job['path']) == os.path.abspath(self.engine.file_path):
+                self._reload_saved_file(job['written_ids'])
             else:
-                doc.save(save_path)
-            doc.close()
-
-            if not is_temporary_save:
-                self.action_history.clear()
-                self.update_ui_states()
-                messagebox.showinfo(self._("success_title"), f"{self._('pdf_saved_successfully_to')} {save_path}")
-            
-            return True
-        except Exception as e:
-            messagebox.showerror(self._("error_title"), f"{self._('failed_to_save_pdf')}: {e}")
-            return False
+                self.engine.mark_saved(job['saved_ids'])
+        self.update_ui_states()
+
+        if 'error' in job:
+            messagebox.showerror(self._("error_title"), f"{self._('failed_to_save_pdf')}: {job['error']}")
+        elif succeeded and job['on_success']:
+            job['on_success']()
+        elif succeeded:
+            messagebox.showinfo(self._("success_title"), f"{self._('pdf_saved_successfully_to')} {job['path']}")
+
+    def _close_file_readers(self):
+        # Stops the render, thumbnail and text index workers and waits (briefly)
+        # for them to close their documents; _reload_saved_file starts new ones
+        readers = [self.render_scheduler, self.thumbnail_sidebar.loader, self.text_indexer]
+        for reader in readers:
+            if reader: reader.close()
+        for reader in readers:
+            if reader: reader.join(self.reader_close_timeout)
+        self.render_scheduler = None
+        self.text_indexer = None
+        self.thumbnail_sidebar.clear()
+
+    def _reload_saved_file(self, annotation_ids):
+        # The file on disk now holds these placements: they stop being overlays
+        # and the pages are rendered again from the new file. Its thumbnails and
+        # text index are keyed by a new hash.
+        self.engine.saved_in_place(annotation_ids)
+        if self.render_scheduler: self.render_scheduler.close()
+        self.render_scheduler = RenderScheduler(self.root, self.engine.file_path, self._on_page_rendered,
+                                                data=self.engine.file_data)
+        self.render_cache.clear()
+        self._clear_overlay_layers()
+        self.display_pages()
+        self._start_file_caches()
 
     def print_pdf(self):
-        if not self.pdf_document:
+        if not self.engine.document:
             messagebox.showwarning(self._("print_error_title"), self._("open_pdf_first"))
             return
 
-        # If there are changes, always save to a temporary file for printing
-        if self.action_history:
-            temp_fd, temp_path = tempfile.mkstemp(suffix=".pdf")
-            os.close(temp_fd)
-            
-            # Save to temp file without clearing history or showing message
-            if not self._perform_save(temp_path, is_temporary_save=True):
-                if os.path.exists(temp_path): os.unlink(temp_path)
-                return
-            filepath_to_print = temp_path
-        else:
+        pages = self._ask_page_range(self._("print_pdf"))
+        if pages is None: return
+
+        if not len(self.engine.annotations) and len(pages) == self.engine.page_count:
             # No changes, print the original file
-            filepath_to_print = self.file_path
+            self._print_file(self.engine.file_path)
+            return
 
+        # Only the requested pages go into the temporary file, copied from the open document
+        temp_fd, temp_path = tempfile.mkstemp(suffix=".pdf")
+        os.close(temp_fd)
+        try:
+            self.engine.save_pages(pages, temp_path)
+        except Exception as e:
+            os.unlink(temp_path)
+            messagebox.showerror(self._("error_title"), f"{self._('failed_to_save_pdf')}: {e}")
+            return
+        self._print_file(temp_path, temp_path)
+
+    def export_page_range(self):
+        if not self.engine.document: return
+        pages = self._ask_page_range(self._("export_pages"))
+        if pages is None: return
+        save_path = filedialog.asksaveasfilename(defaultextension=".pdf", filetypes=[("PDF Files", "*.pdf")])
+        if not save_path: return
+        try:
+            self.engine.save_pages(pages, save_path)
+            messagebox.showinfo(self._("success_title"), f"{self._('pdf_saved_successfully_to')} {save_path}")
+        except Exception as e:
+            messagebox.showerror(self._("error_title"), f"{self._('failed_to_save_pdf')}: {e}")
+
+    def _ask_page_range(self, title):
+        # Sorted 0-based page numbers, or None if cancelled
+        count = self.engine.page_count
+        text = simpledialog.askstring(title, self._("page_range_prompt").format(count=count),
+                                      initialvalue=f"1-{count}", parent=self.root)
+        if text is None: return None
+        try:
+            return parse_page_range(text, count)
+        except ValueError:
+            messagebox.showerror(self._("error_title"), self._("invalid_page_range").format(text))
+            return None
+
+    def _print_file(self, filepath_to_print, temp_path=None):
         try:
             current_os = platform.system()
             if current_os == "Windows":
@@ -613,20 +1416,62 @@ class PDFEditor:
         except Exception as e:
             messagebox.showerror(self._("error_title"), f"{self._('could_not_open_print_dialog')}: {e}")
         finally:
-            if 'temp_path' in locals() and filepath_to_print == temp_path and os.path.exists(temp_path):
+            if temp_path and os.path.exists(temp_path):
                 self.root.after(5000, lambda: os.unlink(temp_path))
 
 
+    def export_images(self):
+        if not self.engine.document: return
+        output_dir = filedialog.askdirectory(title=self._("export_images_title"))
+        if not output_dir: return
+        dpi = simpledialog.askinteger(self._("export_images_title"), self._("export_dpi_prompt"),
+                                      initialvalue=150, minvalue=36, maxvalue=1200, parent=self.root)
+        if not dpi: return
+
+        # Pages are rasterized by a process pool; this thread only waits for it.
+        # Imported here because multiprocessing is slow to import and rarely needed.
+        from pdf_export import export_pages
+        manifest = self.engine.to_manifest()
+        file_path = self.engine.file_path
+        result = {}
+        def run():
+            try:
+                result['written'] = export_pages(file_path, output_dir, manifest=manifest, dpi=dpi)
+            except Exception as e:
+                result['error'] = e
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self._poll_export(thread, result, output_dir)
+
+    def _poll_export(self, thread, result, output_dir):
+        if thread.is_alive():
+            self.root.after(200, lambda: self._poll_export(thread, result, output_dir))
+        elif 'error' in result:
+            messagebox.showerror(self._("error_title"), f"{self._('failed_to_export_images')}: {result['error']}")
+        else:
+            messagebox.showinfo(self._("success_title"), f"{self._('pages_exported_to')} {output_dir}")
+
     def _on_closing(self):
-        if self.action_history:
+        if self._save_job:
+            # Let the running save finish (or be cancelled) first
+            self.root.after(200, self._on_closing)
+            return
+        if self.engine.annotations.can_undo:
             response = messagebox.askyesnocancel(self._("confirm_exit_title"), self._("save_changes_prompt"))
             if response is True:
-                if self._save_document():
-                    self.root.destroy()
+                self._save_document(on_success=self._destroy)
             elif response is False:
-                self.root.destroy()
+                self._destroy()
         else:
-            self.root.destroy()
+            self._destroy()
+
+    def _destroy(self):
+        # Leaving on purpose (saved or discarded), so there is nothing left to recover
+        self.engine.stop_journal(discard=True)
+        if self.render_scheduler: self.render_scheduler.close()
+        self.thumbnail_sidebar.clear()
+        if self.text_indexer: self.text_indexer.close()
+        self.root.destroy()
 
 if __name__ == "__main__":
     root = tk.Tk()
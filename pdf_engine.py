@@ -0,0 +1,518 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+from lazy_imports import lazy_import
+
+fitz = lazy_import('fitz')  # PyMuPDF
+Image = lazy_import('PIL.Image')
+
+from annotations import AnnotationStore, ImageAnnotation, TextAnnotation
+from journal import AutosaveJournal
+from spatial_index import OverlayIndex
+from tracing import traced, tracer
+
+
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+def rgb_to_hex(color):
+    return '#' + ''.join(f"{int(round(c * 255)):02x}" for c in color)
+
+
+def open_document(file_path, data=None):
+    # data holds the file's contents when it was read into memory (see
+    # PDFEditEngine.open); every handle on it is then parsed from those bytes
+    if data is not None:
+        return fitz.open(stream=data, filetype='pdf')
+    return fitz.open(file_path)
+
+
+def parse_page_range(text, page_count):
+    # "1-3, 7, 10-" -> sorted 0-based page numbers; empty text means every page
+    text = text.strip()
+    if not text:
+        return list(range(page_count))
+    pages = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start, dash, end = part.partition('-')
+        first = int(start) if start.strip() else 1
+        last = (int(end) if end.strip() else page_count) if dash else first
+        if not 1 <= first <= last <= page_count:
+            raise ValueError(f"page range out of bounds: {part}")
+        pages.update(range(first - 1, last))
+    return sorted(pages)
+
+
+def _page_runs(pages):
+    # Sorted page numbers -> (first, last) runs of consecutive pages
+    runs = []
+    for page_num in pages:
+        if runs and runs[-1][1] == page_num - 1:
+            runs[-1][1] = page_num
+        else:
+            runs.append([page_num, page_num])
+    return runs
+
+
+FICLONE = 0x40049409  # Linux ioctl that shares the data blocks of another file
+
+
+def copy_file_fast(src, dst):
+    # Clones the file on copy-on-write filesystems (Btrfs, XFS) and otherwise
+    # falls back to shutil, which copies inside the kernel where it can
+    if sys.platform.startswith('linux'):
+        import fcntl
+        try:
+            with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+
+_glyph_widths = {}
+
+
+def text_width(text, fontname, fontsize):
+    # Same result as fitz.get_text_length, but each glyph is only measured once per font
+    widths = _glyph_widths.setdefault(fontname, {})
+    total = 0.0
+    for char in text:
+        width = widths.get(char)
+        if width is None:
+            width = widths[char] = fitz.get_text_length(char, fontname=fontname, fontsize=1)
+        total += width
+    return total * fontsize
+
+
+class SaveCancelled(Exception):
+    pass
+
+
+class ReplaceFailed(OSError):
+    # Copying a save over its target failed partway: the target may be
+    # incomplete, and kept_path holds the complete new file
+    def __init__(self, error, kept_path):
+        super().__init__(error.errno, f"{error.strerror}; the saved file was kept at {kept_path}", error.filename)
+        self.kept_path = kept_path
+
+
+class PDFEditEngine:
+    # GUI-free editing model: the open document, the placed images and text,
+    # and the logic that stamps them into a saved PDF. The Tk editor and the
+    # command line are both clients of this class.
+    def __init__(self, file_path=None):
+        self.file_path = None
+        self.document = None
+        self.file_data = None  # file contents when opened in memory
+        self.annotations = AnnotationStore()
+        self.page_layout_info = []
+        self.page_sizes_resolved = 0
+
+        # Bounding boxes of all placements, per page, for hit-testing
+        self.overlay_index = OverlayIndex()
+
+        # Optional crash-recovery log of every action (see start_journal)
+        self.journal = None
+
+        # Optionally shrink placed images to the resolution they are printed at when saving
+        self.downsample_images = False
+        self.image_target_dpi = 150
+
+        if file_path:
+            self.open(file_path)
+
+    @traced('open', 'io')
+    def open(self, file_path, in_memory=False):
+        # in_memory reads the file once and parses it from RAM (handy for slow or
+        # network drives); the same bytes are passed on to the background readers.
+        file_data = None
+        if in_memory:
+            with open(file_path, 'rb') as f:
+                file_data = f.read()
+        document = open_document(file_path, file_data)
+        self.close()
+        self.stop_journal()
+        self.file_path = file_path
+        self.document = document
+        self.file_data = file_data
+        self.annotations.clear()
+        self.overlay_index.clear()
+
+        # Loading every page just to read its size is what makes huge files slow
+        # to open. Most documents use one page size throughout, so every page
+        # starts out with the size of the first one; resolve_page_sizes() then
+        # checks the real sizes a batch at a time.
+        first = document.load_page(0).rect if document.page_count else fitz.Rect()
+        self.page_layout_info = [{'original_width': first.width, 'original_height': first.height}
+                                 for _ in range(document.page_count)]
+        self.page_sizes_resolved = min(1, document.page_count)
+
+    @property
+    def page_sizes_pending(self):
+        return self.page_sizes_resolved < self.page_count
+
+    def resolve_page_sizes(self, count=500):
+        # Replaces the estimated sizes of the next count pages with their real ones
+        # and returns the page numbers whose size turned out to be different
+        changed = []
+        end = min(self.page_count, self.page_sizes_resolved + count)
+        for page_num in range(self.page_sizes_resolved, end):
+            rect = self.document.load_page(page_num).rect
+            info = self.page_layout_info[page_num]
+            if (info['original_width'], info['original_height']) != (rect.width, rect.height):
+                info['original_width'] = rect.width
+                info['original_height'] = rect.height
+                changed.append(page_num)
+        self.page_sizes_resolved = end
+        return changed
+
+    def close(self):
+        if self.document:
+            self.document.close()
+        self.document = None
+        self.file_data = None
+
+    @property
+    def page_count(self):
+        return self.document.page_count if self.document else 0
+
+    @property
+    def action_history(self):
+        # Undoable additions since the last save, oldest first
+        return [self.annotations.get(annotation_id) for annotation_id in self.annotations.history_ids()]
+
+    @property
+    def dirty_pages(self):
+        # Pages carrying placements, i.e. the only ones that differ from the original
+        return self.annotations.pages()
+
+    @property
+    def images_to_embed(self):
+        return self.annotations.of_kind('image')
+
+    @property
+    def text_to_embed(self):
+        return self.annotations.of_kind('text')
+
+    def add_image(self, page_num, path, rel_x, rel_y, rel_w, rel_h):
+        return self._add(ImageAnnotation(page_num, path, rel_x, rel_y, rel_w, rel_h))
+
+    def add_text(self, page_num, rel_x, rel_y, text, font='Helvetica', size=12, color=(0, 0, 0)):
+        return self._add(TextAnnotation(page_num, rel_x, rel_y, text, font, size, tuple(color)))
+
+    def undo(self, annotation_id=None):
+        # Undoes the latest addition, or the one with the given id
+        annotation = self.annotations.undo(annotation_id)
+        if annotation is not None:
+            self.overlay_index.remove(annotation.id)
+            if self.journal: self.journal.record_undo(annotation)
+        return annotation
+
+    def redo(self):
+        annotation = self.annotations.redo()
+        if annotation is not None:
+            self.overlay_index.insert(annotation.page_num, annotation.id, self.item_bbox(annotation))
+            if self.journal: self.journal.record_redo(annotation)
+        return annotation
+
+    def _add(self, annotation):
+        self.annotations.add(annotation)
+        self.overlay_index.insert(annotation.page_num, annotation.id, self.item_bbox(annotation))
+        if self.journal: self.journal.record_add(annotation)
+        return annotation
+
+    def mark_saved(self, annotation_ids=None):
+        self.annotations.mark_saved(annotation_ids)
+        if self.journal: self.journal.start(self.action_history)
+
+    def saved_in_place(self, annotation_ids):
+        # After a save over file_path the file holds these annotations itself, so
+        # they are dropped instead of being stamped into it again by the next save
+        # (or into a Save As copy of it), and the document is reopened to show them
+        self.annotations.discard(annotation_ids)
+        for annotation_id in annotation_ids:
+            self.overlay_index.remove(annotation_id)
+        self.reopen()
+        if self.journal: self.journal.start(self.action_history)
+
+    def reopen(self):
+        # Opens file_path again after it changed on disk, keeping the placements
+        if self.file_data is not None:
+            with open(self.file_path, 'rb') as f:
+                self.file_data = f.read()
+        document = open_document(self.file_path, self.file_data)
+        if self.document:
+            self.document.close()
+        self.document = document
+
+    def snapshot(self):
+        # A detached engine with the current placements and settings, safe to save
+        # from a worker thread while this one keeps being edited
+        engine = PDFEditEngine()
+        engine.file_path = self.file_path
+        engine.annotations = self.annotations.snapshot()
+        engine.downsample_images = self.downsample_images
+        engine.image_target_dpi = self.image_target_dpi
+        return engine
+
+    def start_journal(self):
+        # Journals all further actions for the open file, starting from the unsaved ones
+        self.stop_journal()
+        self.journal = AutosaveJournal(self.file_path)
+        self.journal.start(self.action_history)
+
+    def stop_journal(self, discard=False):
+        if self.journal:
+            if discard:
+                self.journal.discard()
+            else:
+                self.journal.close()
+        self.journal = None
+
+    def replay_actions(self, records):
+        # Re-applies journaled actions (see journal.read_unsaved_actions). Ids are
+        # reassigned, so journal ids are mapped to the new annotations as we go.
+        journal, self.journal = self.journal, None
+        new_ids = {}
+        try:
+            for record in records:
+                op = record['op']
+                if op == 'add':
+                    new_ids[record['id']] = self._replay_add(record).id
+                elif op == 'undo' and record['id'] in new_ids:
+                    self.undo(new_ids[record['id']])
+                elif op == 'redo':
+                    redo_stack = self.annotations.redo_stack
+                    if record['id'] in new_ids and redo_stack and redo_stack[-1] == new_ids[record['id']]:
+                        self.redo()
+                    elif 'kind' in record:
+                        # Undone before the journal started (e.g. before a save),
+                        # so it is not on the replayed redo stack
+                        new_ids[record['id']] = self._replay_add(record).id
+        finally:
+            self.journal = journal
+        return len(records)
+
+    def _replay_add(self, record):
+        if record['kind'] == 'image':
+            return self.add_image(record['page_num'], record['path'], record['rel_x'],
+                                  record['rel_y'], record['rel_w'], record['rel_h'])
+        return self.add_text(record['page_num'], record['rel_x'], record['rel_y'], record['text'],
+                             font=record['font'], size=record['size'], color=record['color'])
+
+    def item_bbox(self, item):
+        # Bounding box of a placement in PDF points relative to its page
+        if item.kind == 'image':
+            return item.bbox()
+        width = text_width(item.text, item.font.lower(), item.size)
+        # Text is inserted with its baseline one font size below rel_y; leave room for descenders
+        return (item.rel_x, item.rel_y, item.rel_x + width, item.rel_y + item.size * 1.25)
+
+    @traced('hit_test', 'input')
+    def overlay_at(self, page_num, x, y):
+        # Topmost (most recently placed) overlay containing the point, or None
+        ids = self.overlay_index.query_point(page_num, x, y)
+        return self.annotations.get(max(ids)) if ids else None
+
+    @traced('hit_test_rect', 'input')
+    def overlays_in(self, page_num, bbox):
+        return [self.annotations.get(i) for i in sorted(self.overlay_index.query_rect(page_num, bbox))]
+
+    def apply_manifest(self, manifest, base_dir='.'):
+        # A manifest holds lists of image and text placements with the fields of
+        # ImageAnnotation / TextAnnotation. Image paths are relative to base_dir
+        # and colors may be given as 0-1 RGB triples or "#rrggbb" strings.
+        for item in manifest.get('images', []):
+            self.add_image(item['page_num'], os.path.join(base_dir, item['path']),
+                           item['rel_x'], item['rel_y'], item['rel_w'], item['rel_h'])
+        for item in manifest.get('text', []):
+            color = item.get('color', (0, 0, 0))
+            if isinstance(color, str):
+                color = hex_to_rgb(color)
+            self.add_text(item['page_num'], item['rel_x'], item['rel_y'], item['text'],
+                          font=item.get('font', 'Helvetica'), size=item.get('size', 12), color=color)
+
+    def to_manifest(self):
+        # Plain (picklable, JSON-serializable) copy of the placements in apply_manifest's format
+        return {
+            'images': [item.to_dict() for item in self.images_to_embed],
+            'text': [item.to_dict() for item in self.text_to_embed],
+        }
+
+    @traced('apply_edits', 'save')
+    def apply_edits(self, doc, pages=None, image_streams=None, on_page=None, cancel_event=None, page_map=None):
+        # pages optionally limits stamping to a set of page numbers; image_streams
+        # maps image paths to already-loaded file contents to use instead of the file.
+        # on_page(done, total) reports progress and a set cancel_event raises SaveCancelled.
+        # page_map maps page numbers to their index in doc when it holds only some pages.
+        page_nums = self.annotations.pages()
+        if pages is not None:
+            page_nums = [p for p in page_nums if p in pages]
+
+        # Embed each distinct image once and point later placements at the same xref
+        image_xrefs = {}
+        image_streams = dict(image_streams or {})
+        if self.downsample_images:
+            image_streams.update(self._downsampled_image_streams())
+
+        for done, page_num in enumerate(page_nums):
+            if cancel_event is not None and cancel_event.is_set():
+                raise SaveCancelled()
+            if on_page: on_page(done, len(page_nums))
+            page = doc.load_page(page_map[page_num] if page_map else page_num)
+            items = self.annotations.on_page(page_num)
+            # Images first so that text placed on the same page stays on top
+            for item in items:
+                if item.kind != 'image': continue
+                rect = fitz.Rect(item.bbox())
+                path = item.path
+                if path in image_xrefs:
+                    page.insert_image(rect, xref=image_xrefs[path])
+                elif path in image_streams:
+                    image_xrefs[path] = page.insert_image(rect, stream=image_streams[path])
+                else:
+                    image_xrefs[path] = page.insert_image(rect, filename=path)
+
+            for item in items:
+                if item.kind != 'text': continue
+                point = fitz.Point(item.rel_x, item.rel_y + item.size)
+                page.insert_text(point, item.text,
+                                  fontname=item.font.lower(),
+                                  fontsize=item.size,
+                                  color=item.color)
+        if on_page: on_page(len(page_nums), len(page_nums))
+
+    @traced('save', 'io')
+    def save(self, save_path, compact=False, linearize=False, on_page=None, cancel_event=None, replace=True):
+        # By default only the stamped objects are written: saving over the original
+        # appends an incremental update to it, and saving to a new path appends one
+        # to a byte copy of it, so the time depends on the edits, not the file size.
+        # compact rewrites the whole file, dropping unused objects and deflating
+        # streams; linearize writes a "fast web view" file (also a full rewrite).
+        #
+        # A failed or cancelled save leaves the target as it was: new content is
+        # written to a temporary file next to it and renamed over it at the end,
+        # except for an update appended in place, which is truncated away again.
+        # With replace=False that temporary file is left for the caller, who gets
+        # its path (None if nothing needs replacing) and moves it into place with
+        # replace_file() once its own readers of the target are closed.
+        same_file = os.path.abspath(save_path) == os.path.abspath(self.file_path)
+        detached = self.document is None  # a snapshot; its editor updates itself
+        doc = fitz.open(self.file_path)
+        incremental = not (compact or linearize) and doc.can_save_incrementally()
+        temp_path = None
+        append_from = None
+        try:
+            if incremental and same_file:
+                append_from = os.path.getsize(save_path)
+            else:
+                fd, temp_path = tempfile.mkstemp(suffix='.pdf', dir=os.path.dirname(os.path.abspath(save_path)))
+                os.close(fd)
+                shutil.copymode(save_path if os.path.exists(save_path) else self.file_path, temp_path)
+                if incremental:
+                    doc.close()
+                    copy_file_fast(self.file_path, temp_path)
+                    doc = fitz.open(temp_path)
+
+            self.apply_edits(doc, on_page=on_page, cancel_event=cancel_event)
+            with tracer.span('write', 'io', incremental=bool(incremental)):
+                if incremental:
+                    doc.save(doc.name, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP, deflate_images=True)
+                else:
+                    options = dict(deflate_images=True)
+                    if compact: options.update(garbage=3, deflate=True, deflate_fonts=True)
+                    if linearize: options.update(linear=True)
+                    doc.save(temp_path, **options)
+            doc.close()
+            if temp_path and replace:
+                self.replace_file(temp_path, save_path)
+        except BaseException as e:
+            if not doc.is_closed:
+                doc.close()
+            if temp_path and os.path.exists(temp_path) and not isinstance(e, ReplaceFailed):
+                os.remove(temp_path)
+            if append_from is not None and os.path.getsize(save_path) > append_from:
+                os.truncate(save_path, append_from)
+            raise
+        if not replace:
+            return temp_path
+        if same_file and not detached:
+            self.saved_in_place(self.annotations.ids())
+        return None
+
+    def replace_file(self, temp_path, save_path):
+        # Moves a finished save over save_path. Windows cannot rename over a file
+        # that is open, so the document is closed first when it was read from
+        # there (saved_in_place opens it again). If the rename still fails,
+        # because some other program has the file open, the new content is
+        # copied over the old instead. That copy is not atomic, so the temporary
+        # file is only removed once it has succeeded; if it fails, the temporary
+        # file is kept and ReplaceFailed names it.
+        closed = (self.document is not None and self.file_data is None
+                  and os.path.abspath(save_path) == os.path.abspath(self.file_path))
+        if closed:
+            self.document.close()
+            self.document = None
+        try:
+            try:
+                os.replace(temp_path, save_path)
+            except OSError:
+                try:
+                    shutil.copyfile(temp_path, save_path)
+                except OSError as e:
+                    raise ReplaceFailed(e, temp_path) from e
+                os.remove(temp_path)
+        except BaseException as e:
+            if os.path.exists(temp_path) and not isinstance(e, ReplaceFailed):
+                os.remove(temp_path)
+            if closed and not isinstance(e, ReplaceFailed):
+                self.reopen()  # after ReplaceFailed the target may not be readable
+            raise
+
+    @traced('save_pages', 'io')
+    def save_pages(self, pages, output_path):
+        # Writes only the given pages (sorted, 0-based) with their placements to a
+        # new PDF, copied from the already-open document, so the cost depends on
+        # the number of pages and not on the size of the whole file
+        doc = fitz.open()
+        try:
+            for first, last in _page_runs(pages):
+                doc.insert_pdf(self.document, from_page=first, to_page=last)
+            self.apply_edits(doc, pages=set(pages), page_map={page_num: i for i, page_num in enumerate(pages)})
+            doc.save(output_path, deflate_images=True)
+        finally:
+            doc.close()
+
+    def _downsampled_image_streams(self):
+        # The largest placement of each image decides the resolution it needs
+        placements = {}
+        for item in self.images_to_embed:
+            w, h = placements.get(item.path, (0, 0))
+            placements[item.path] = (max(w, item.rel_w), max(h, item.rel_h))
+
+        streams = {}
+        for path, (rect_w, rect_h) in placements.items():
+            with Image.open(path) as img:
+                target_w = rect_w / 72 * self.image_target_dpi
+                target_h = rect_h / 72 * self.image_target_dpi
+                scale = max(target_w / img.width, target_h / img.height)
+                if scale >= 1:
+                    continue
+                img = img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.LANCZOS)
+                buffer = io.BytesIO()
+                if img.mode in ('RGBA', 'LA', 'P'):
+                    img.save(buffer, format='PNG', optimize=True)
+                else:
+                    img.convert('RGB').save(buffer, format='JPEG', quality=85)
+                streams[path] = buffer.getvalue()
+        return streams
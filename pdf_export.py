@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import fitz  # PyMuPDF
+
+from pdf_engine import PDFEditEngine
+
+
+def page_chunks(page_count, chunk_size):
+    return [range(start, min(start + chunk_size, page_count)) for start in range(0, page_count, chunk_size)]
+
+
+def export_page_path(output_dir, stem, page_num, fmt):
+    return os.path.join(output_dir, f"{stem}-{page_num + 1:04d}.{fmt}")
+
+
+def _export_chunk(pdf_path, manifest, pages, output_dir, stem, dpi, fmt):
+    # Runs in a worker process: open a private handle, stamp only the
+    # overlays that land on this chunk, and write each page as it finishes.
+    engine = PDFEditEngine(pdf_path)
+    engine.apply_manifest(manifest)
+    engine.apply_edits(engine.document, pages=set(pages))
+
+    written = []
+    for page_num in pages:
+        pix = engine.document.load_page(page_num).get_pixmap(dpi=dpi, alpha=False)
+        path = export_page_path(output_dir, stem, page_num, fmt)
+        pix.save(path)
+        written.append(path)
+    engine.close()
+    return written
+
+
+def export_pages(pdf_path, output_dir, manifest=None, dpi=150, fmt='png', workers=None, chunk_size=16,
+                 pages=None, on_page=None):
+    # Rasterizes the document (with its overlays) to one image per page using
+    # a process pool. on_page(path) is called in this process as files land.
+    fmt = fmt.lower()
+    if fmt == 'jpeg': fmt = 'jpg'
+    if fmt not in ('png', 'jpg'):
+        raise ValueError(f"Unsupported export format: {fmt}")
+    manifest = manifest or {}
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(pdf_path))[0]
+
+    if pages is None:
+        with fitz.open(pdf_path) as doc:
+            pages = range(doc.page_count)
+    pages = list(pages)
+    chunks = [[pages[i] for i in chunk] for chunk in page_chunks(len(pages), chunk_size)]
+
+    written = []
+    # Spawned rather than forked: export runs on a background thread of the editor,
+    # and a forked child would inherit Tk and locks held by its other threads
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(_export_chunk, pdf_path, manifest, chunk, output_dir, stem, dpi, fmt)
+                   for chunk in chunks]
+        for future in as_completed(futures):
+            for path in future.result():
+                written.append(path)
+                if on_page: on_page(path)
+    return written
@@ -0,0 +1,321 @@
+import io
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, deque
+
+from lazy_imports import lazy_import
+
+fitz = lazy_import('fitz')  # PyMuPDF
+tk = lazy_import('tkinter')  # only needed on the Tk thread, so headless users can import this module
+Image = lazy_import('PIL.Image')
+ImageTk = lazy_import('PIL.ImageTk')
+
+from background import BackgroundWorker
+from pdf_engine import open_document
+from tracing import tracer
+
+TILE_SIZE = 512  # pixels per side of a tile at the rendered zoom
+
+
+def tile_clip(page_rect, zoom, tile):
+    col, row = tile
+    clip = fitz.Rect(col * TILE_SIZE, row * TILE_SIZE, (col + 1) * TILE_SIZE, (row + 1) * TILE_SIZE) / zoom
+    return clip & page_rect
+
+
+def render_page_samples(doc, page_num, zoom, tile=None):
+    # tile is None for the whole page, or a (col, row) pair to render only
+    # that TILE_SIZE square through PyMuPDF's clip rectangle.
+    with tracer.span('render', 'render', page=page_num, zoom=zoom, tile=tile):
+        page = doc.load_page(page_num)
+        clip = tile_clip(page.rect, zoom, tile) if tile is not None else None
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+        return pix.width, pix.height, pix.samples
+
+
+def render_page_ppm(doc, page_num, zoom, tile=None):
+    # Same as render_page_samples, but returns binary PPM that Tk decodes
+    # straight into a photo image (see ppm_photo_image). The header is joined
+    # to a view of the pixmap's own buffer, so the pixels are copied once here
+    # and once more by Tk, instead of also going through a Pillow image.
+    with tracer.span('render', 'render', page=page_num, zoom=zoom, tile=tile):
+        page = doc.load_page(page_num)
+        clip = tile_clip(page.rect, zoom, tile) if tile is not None else None
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), clip=clip, alpha=False)
+        header = b"P6\n%d %d\n255\n" % (pix.width, pix.height)
+        return pix.width, pix.height, b"".join((header, pix.samples_mv))
+
+
+def ppm_photo_image(ppm, master=None):
+    # Naming the format spares Tk from probing every registered image handler
+    return tk.PhotoImage(master=master, data=ppm, format='PPM')
+
+
+def ppm_to_image(ppm):
+    # Pillow view of a rendered page, only needed for rescaled zoom previews
+    return Image.open(io.BytesIO(ppm))
+
+
+class RenderCache:
+    # LRU cache of rendered pages keyed by (page_num, zoom, tile), bounded by the
+    # number of bytes held in pixmap buffers and Tk photo images.
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value, nbytes):
+        self.discard(key)
+        self._entries[key] = (value, nbytes)
+        self.current_bytes += nbytes
+        while self.current_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, evicted_bytes) = self._entries.popitem(last=False)
+            self.current_bytes -= evicted_bytes
+            self.evictions += 1
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.current_bytes -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self.current_bytes = 0
+
+    def stats(self):
+        return {'entries': len(self._entries), 'bytes': self.current_bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def photo_image_nbytes(width, height):
+    # Tk stores photo images as 32-bit RGBA regardless of the source format
+    return width * height * 4
+
+
+class ImageCache:
+    # Decodes each overlay image file once and keeps resized Tk photos per
+    # (path, size, quality) so that repeated placements share one bitmap.
+    # Names of Pillow resampling filters, looked up on use since Pillow is imported lazily
+    FAST_FILTER = 'NEAREST'
+    HIGH_QUALITY_FILTER = 'LANCZOS'
+
+    def __init__(self, max_bytes=128 * 1024 * 1024, max_source_bytes=128 * 1024 * 1024):
+        self.variants = RenderCache(max_bytes=max_bytes)
+        self.sources = RenderCache(max_bytes=max_source_bytes)
+
+    def source(self, path):
+        img = self.sources.get(path)
+        if img is None:
+            img = Image.open(path)
+            img.load()
+            self.sources.put(path, img, img.width * img.height * len(img.getbands()))
+        return img
+
+    def get(self, path, size, high_quality=True):
+        size = (max(1, size[0]), max(1, size[1]))
+        key = (path, size, high_quality)
+        tk_img = self.variants.get(key)
+        if tk_img is None:
+            resample = getattr(Image, self.HIGH_QUALITY_FILTER if high_quality else self.FAST_FILTER)
+            tk_img = ImageTk.PhotoImage(image=self.source(path).resize(size, resample))
+            self.variants.put(key, tk_img, photo_image_nbytes(*size))
+        return tk_img
+
+    def clear(self):
+        self.variants.clear()
+        self.sources.clear()
+
+
+def default_render_workers():
+    return min(4, os.cpu_count() or 1)
+
+
+def _render_process(conn):
+    # Body of a render process. It renders pages of the document it was last
+    # told to open: each reply is (width, height) followed by the pixel bytes,
+    # or None when the page could not be rendered.
+    tracer.enabled = False  # the scheduler records each page on the editor's side
+    doc = None
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        command = message[0]
+        if command == 'open':
+            _, file_path, data = message
+            try:
+                doc = open_document(file_path, data)
+            except Exception:
+                doc = None
+        elif command == 'close':
+            if doc is not None:
+                doc.close()
+                doc = None
+            conn.send(True)
+        elif command == 'render':
+            _, render, key = message
+            try:
+                width, height, pixels = render(doc, *key)
+            except Exception:
+                conn.send(None)
+                continue
+            conn.send((width, height))
+            conn.send_bytes(pixels)
+
+
+# Render processes between documents, as (process, connection) pairs
+_idle_processes = []
+_idle_lock = threading.Lock()
+
+
+def _spawn_render_process():
+    # Spawned, not forked: the editor has Tk and other threads running
+    context = multiprocessing.get_context('spawn')
+    conn, child_conn = context.Pipe()
+    process = context.Process(target=_render_process, args=(child_conn,), daemon=True)
+    process.start()
+    child_conn.close()
+    return process, conn
+
+
+def start_render_processes(count=None):
+    # Starts the render processes before the first document is opened, so that
+    # its first page does not wait for them to start and import PyMuPDF
+    with _idle_lock:
+        missing = (count or default_render_workers()) - len(_idle_processes)
+    for _ in range(missing):
+        _return_render_process(_spawn_render_process())
+
+
+def _take_render_process():
+    with _idle_lock:
+        while _idle_processes:
+            process, conn = _idle_processes.pop()
+            if process.is_alive():
+                return process, conn
+            conn.close()
+    return _spawn_render_process()
+
+
+def _return_render_process(render_process):
+    with _idle_lock:
+        _idle_processes.append(render_process)
+
+
+class RenderScheduler(BackgroundWorker):
+    # Rasterizes pages in a pool of render processes, one per worker thread.
+    # PyMuPDF holds the GIL while it renders (a 4x page blocked the Tk thread
+    # for 238 ms) and does not support rendering on several threads, so the
+    # threads here only send each page to their process and wait on the pipe;
+    # finished pages are handed back to the Tk thread through root.after so
+    # that on_result always runs on the main loop. Processes outlive the
+    # scheduler and are reused for the next document (see
+    # start_render_processes). When data holds the file contents, processes
+    # parse a copy of those bytes instead of reading file_path. render picks
+    # the pixel format handed to on_result: PPM bytes by default, or raw RGB
+    # with render_page_samples; it runs in the render process, so it has to
+    # be a module-level function.
+    POLL_MS = 15
+
+    def __init__(self, root, file_path, on_result, workers=None, data=None, render=render_page_ppm):
+        super().__init__(root, file_path, data=data, threads=workers or default_render_workers())
+        self.on_result = on_result
+        self.render = render
+        self._wanted = set()
+        self._in_flight = set()
+        self._start()
+
+    def schedule(self, keys):
+        # keys are (page_num, zoom, tile) tuples in priority order. Anything queued
+        # earlier that is not in this list is cancelled.
+        with self._cond:
+            self._wanted = set(keys)
+            self._pending = deque(k for k in keys if k not in self._in_flight)
+            self._cond.notify_all()
+        if keys:
+            self._poll_soon()
+
+    def cancel_all(self):
+        self.schedule([])
+
+    def close(self):
+        with self._cond:
+            self._wanted.clear()
+        super().close()
+
+    def _taking(self, key):
+        self._in_flight.add(key)
+
+    def _worker(self):
+        render_process = None
+        while True:
+            key = self._next_item()
+            if key is None:
+                break
+            result = None
+            try:
+                if render_process is None:
+                    render_process = _take_render_process()
+                    render_process[1].send(('open', self.file_path, self.data))
+                result = self._render_in(render_process[1], key)
+            except Exception:
+                # The process died or could not be started; the next page gets another one
+                if render_process is not None:
+                    render_process[1].close()
+                render_process = None
+            with self._cond:
+                self._in_flight.discard(key)
+                if result is None:
+                    self._wanted.discard(key)
+                elif key in self._wanted:
+                    self._results.put((key, result))
+        if render_process is not None:
+            # Waits for the process to close the document, as join() promises
+            try:
+                render_process[1].send(('close',))
+                render_process[1].recv()
+            except (OSError, EOFError):
+                render_process[1].close()
+            else:
+                _return_render_process(render_process)
+
+    def _render_in(self, conn, key):
+        page_num, zoom, tile = key
+        with tracer.span('render', 'render', page=page_num, zoom=zoom, tile=tile):
+            conn.send(('render', self.render, key))
+            size = conn.recv()
+            if size is None:
+                return None
+            return size[0], size[1], conn.recv_bytes()
+
+    def _deliver(self):
+        for key, (width, height, pixels) in self._results_so_far():
+            with self._cond:
+                if key not in self._wanted:
+                    continue
+                self._wanted.discard(key)
+            self.on_result(key, width, height, pixels)
+
+    def _active(self):
+        with self._cond:
+            return bool(self._wanted) and not self._closed
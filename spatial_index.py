@@ -0,0 +1,85 @@
+from array import array
+from bisect import bisect_right
+
+
+def find_offset_index(offsets, value):
+    # Index of the last offset <= value in a sorted list, or -1
+    return bisect_right(offsets, value) - 1
+
+
+class OverlayIndex:
+    # Overlay bounding boxes (x0, y0, x1, y1) in PDF points, so that it stays
+    # valid at every zoom level, on a uniform grid per page. Boxes are
+    # registered in every cell they overlap, so point and rectangle queries
+    # only look at the handful of boxes near the query. Keys are annotation
+    # ids (small positive integers), which lets boxes and cells live in
+    # arrays: about 40 bytes per overlay instead of a few hundred.
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.clear()
+
+    def __len__(self):
+        return self._count
+
+    def _cell_range(self, bbox):
+        x0, y0, x1, y1 = bbox
+        size = self.cell_size
+        return (range(int(x0 // size), int(x1 // size) + 1),
+                range(int(y0 // size), int(y1 // size) + 1))
+
+    def _box(self, key):
+        return self._boxes[key * 4:key * 4 + 4]
+
+    def insert(self, page_num, key, bbox):
+        self.remove(key)
+        if key >= len(self._page_of):
+            grow = key + 1 - len(self._page_of)
+            self._page_of.extend([-1] * grow)
+            self._boxes.extend([0.0] * (4 * grow))
+        self._page_of[key] = page_num
+        self._boxes[key * 4:key * 4 + 4] = array('f', bbox)
+        cols, rows = self._cell_range(self._box(key))
+        for col in cols:
+            for row in rows:
+                self._cells.setdefault((page_num, col, row), array('I')).append(key)
+        self._count += 1
+
+    def remove(self, key):
+        if key >= len(self._page_of) or self._page_of[key] < 0:
+            return
+        page_num = self._page_of[key]
+        self._page_of[key] = -1
+        cols, rows = self._cell_range(self._box(key))
+        for col in cols:
+            for row in rows:
+                cell = self._cells[(page_num, col, row)]
+                cell.remove(key)
+                if not cell:
+                    del self._cells[(page_num, col, row)]
+        self._count -= 1
+
+    def query_point(self, page_num, x, y):
+        cell = self._cells.get((page_num, int(x // self.cell_size), int(y // self.cell_size)), ())
+        return [key for key in cell if self._contains(self._box(key), x, y)]
+
+    def query_rect(self, page_num, bbox):
+        found = set()
+        cols, rows = self._cell_range(bbox)
+        for col in cols:
+            for row in rows:
+                found.update(self._cells.get((page_num, col, row), ()))
+        return [key for key in found if self._intersects(self._box(key), bbox)]
+
+    def clear(self):
+        self._cells = {}  # (page_num, col, row) -> array of keys
+        self._boxes = array('f')  # key -> x0, y0, x1, y1
+        self._page_of = array('i')  # key -> page_num, or -1 when not indexed
+        self._count = 0
+
+    @staticmethod
+    def _contains(bbox, x, y):
+        return bbox[0] <= x <= bbox[2] and bbox[1] <= y <= bbox[3]
+
+    @staticmethod
+    def _intersects(a, b):
+        return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
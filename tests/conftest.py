@@ -0,0 +1,13 @@
+import fitz
+import pytest
+
+
+@pytest.fixture
+def pdf_path(tmp_path):
+    path = tmp_path / 'doc.pdf'
+    doc = fitz.open()
+    for _ in range(3):
+        doc.new_page()
+    doc.save(path)
+    doc.close()
+    return str(path)
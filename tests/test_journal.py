@@ -0,0 +1,61 @@
+from journal import read_unsaved_actions
+from pdf_engine import PDFEditEngine
+
+
+def recover(pdf_path):
+    # What the editor does after a crash: reopen the file and replay its journal
+    engine = PDFEditEngine(pdf_path)
+    engine.replay_actions(read_unsaved_actions(pdf_path))
+    return engine
+
+
+def texts(engine):
+    return sorted(annotation.text for annotation in engine.text_to_embed)
+
+
+def test_replay_add_undo_redo(pdf_path):
+    engine = PDFEditEngine(pdf_path)
+    engine.start_journal()
+    engine.add_text(0, 72, 72, 'first', color=(1, 0, 0))
+    engine.add_image(1, 'logo.png', 10, 10, 100, 75)
+    engine.add_text(2, 72, 72, 'second')
+    engine.undo()
+    engine.undo()
+    engine.redo()
+    engine.journal.flush()
+
+    recovered = recover(pdf_path)
+    assert texts(recovered) == ['first']
+    assert [a.path for a in recovered.images_to_embed] == ['logo.png']
+    assert recovered.text_to_embed[0].color == (1, 0, 0)
+    recovered.redo()
+    assert texts(recovered) == ['first', 'second']
+    engine.stop_journal(discard=True)
+
+
+def test_replay_redo_across_save(pdf_path):
+    engine = PDFEditEngine(pdf_path)
+    engine.start_journal()
+    kept = engine.add_text(0, 72, 72, 'kept')
+    engine.add_text(1, 72, 72, 'redone')
+    engine.undo()
+    engine.mark_saved([kept.id])
+    engine.redo()
+    engine.journal.flush()
+
+    recovered = recover(pdf_path)
+    assert texts(recovered) == ['redone']
+    engine.stop_journal(discard=True)
+
+
+def test_replay_undo_of_saved_annotation_is_ignored(pdf_path):
+    engine = PDFEditEngine(pdf_path)
+    engine.start_journal()
+    engine.add_text(0, 72, 72, 'saved')
+    engine.mark_saved()
+    engine.add_text(1, 72, 72, 'unsaved')
+    engine.journal.flush()
+
+    recovered = recover(pdf_path)
+    assert texts(recovered) == ['unsaved']
+    engine.stop_journal(discard=True)
@@ -0,0 +1,30 @@
+import fitz
+from PIL import Image
+
+from mail_merge import merge_to_combined
+
+NAMES = ['alice', 'bob', 'carol']
+
+
+def test_combined_copies_do_not_share_stamped_images(tmp_path):
+    base = fitz.open()
+    for _ in range(2):
+        base.new_page().insert_text((72, 72), 'Letter')
+    base.save(tmp_path / 'base.pdf')
+    base.close()
+    for i, name in enumerate(NAMES):
+        Image.new('RGB', (20, 10), (i * 100, 0, 0)).save(tmp_path / f'sig-{name}.png')
+    template = {
+        'images': [{'path': 'sig-{name}.png', 'page_num': 0, 'rel_x': 10, 'rel_y': 10, 'rel_w': 50, 'rel_h': 25}],
+        'text': [{'text': 'Dear {name}', 'page_num': 1, 'rel_x': 72, 'rel_y': 100}],
+    }
+    output = str(tmp_path / 'all.pdf')
+    assert merge_to_combined(str(tmp_path / 'base.pdf'), template, [{'name': n} for n in NAMES], output,
+                             base_dir=str(tmp_path)) == 3
+
+    with fitz.open(output) as doc:
+        signatures = [doc[row * 2].get_images() for row in range(len(NAMES))]
+        assert [len(images) for images in signatures] == [1, 1, 1]
+        assert len({images[0][0] for images in signatures}) == 3
+        assert [doc[row * 2 + 1].get_text().split('\n')[1] for row in range(len(NAMES))] == \
+            [f'Dear {name}' for name in NAMES]
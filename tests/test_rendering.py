@@ -0,0 +1,52 @@
+import time
+
+import rendering
+from rendering import RenderScheduler
+
+
+class FakeRoot:
+    # Just enough of Tk's after() for the scheduler's poll
+    def __init__(self):
+        self.calls = {}
+        self.next_id = 0
+
+    def after(self, ms, func):
+        self.next_id += 1
+        self.calls[self.next_id] = func
+        return self.next_id
+
+    def after_cancel(self, call_id):
+        self.calls.pop(call_id, None)
+
+    def run_until(self, done, timeout=30):
+        deadline = time.monotonic() + timeout
+        while not done() and time.monotonic() < deadline:
+            time.sleep(0.01)
+            for call_id in list(self.calls):
+                self.calls.pop(call_id)()
+
+
+def render(pdf_path, keys, data=None):
+    root = FakeRoot()
+    results = {}
+    scheduler = RenderScheduler(root, pdf_path, lambda key, w, h, ppm: results.update({key: (w, h, ppm)}),
+                                workers=1, data=data)
+    scheduler.schedule(keys)
+    root.run_until(lambda: len(results) == len(keys))
+    scheduler.close()
+    scheduler.join()
+    return results
+
+
+def test_pages_render_in_a_reused_process(pdf_path):
+    results = render(pdf_path, [(0, 1.0, None), (2, 2.0, (0, 0))])
+    width, height, ppm = results[(0, 1.0, None)]
+    assert (width, height) == (595, 842)
+    assert ppm.startswith(b"P6\n595 842\n255\n") and len(ppm) == 15 + width * height * 3
+    assert results[(2, 2.0, (0, 0))][:2] == (512, 512)
+
+    processes = [process for process, _ in rendering._idle_processes]
+    with open(pdf_path, 'rb') as f:
+        data = f.read()
+    assert render(pdf_path, [(1, 1.0, None)], data=data)[(1, 1.0, None)][:2] == (595, 842)
+    assert [process for process, _ in rendering._idle_processes] == processes
@@ -0,0 +1,75 @@
+import fitz
+import pytest
+
+from pdf_engine import PDFEditEngine, ReplaceFailed
+
+
+def stamps(path):
+    with fitz.open(path) as doc:
+        return doc[0].get_text().count('Stamp')
+
+
+@pytest.mark.parametrize('compact', [False, True])
+def test_saving_in_place_again_does_not_restamp(pdf_path, compact):
+    engine = PDFEditEngine(pdf_path)
+    engine.add_text(0, 72, 72, 'Stamp')
+    engine.save(pdf_path, compact=compact)
+    engine.add_text(0, 72, 144, 'Stamp')
+    engine.save(pdf_path, compact=compact)
+    assert stamps(pdf_path) == 2
+    assert len(engine.annotations) == 0
+
+
+def test_save_as_after_saving_in_place(pdf_path, tmp_path):
+    # The editor saves a snapshot and then tells its engine what was written
+    engine = PDFEditEngine(pdf_path)
+    engine.add_text(0, 72, 72, 'Stamp')
+    snapshot = engine.snapshot()
+    snapshot.save(pdf_path)
+    engine.saved_in_place(snapshot.annotations.ids())
+    engine.add_text(0, 72, 144, 'Stamp')
+    engine.snapshot().save(str(tmp_path / 'copy.pdf'))
+    assert stamps(pdf_path) == 1
+    assert stamps(str(tmp_path / 'copy.pdf')) == 2
+
+
+def test_replace_falls_back_to_copying(pdf_path, monkeypatch):
+    # What Windows does when another program still has the file open
+    def refuse(src, dst):
+        raise PermissionError(13, 'The process cannot access the file', dst)
+    monkeypatch.setattr('os.replace', refuse)
+    engine = PDFEditEngine(pdf_path)
+    engine.add_text(0, 72, 72, 'Stamp')
+    engine.save(pdf_path, compact=True)
+    assert stamps(pdf_path) == 1
+    assert engine.document is not None and stamps(pdf_path) == engine.document[0].get_text().count('Stamp')
+
+
+def test_deferred_replace(pdf_path):
+    engine = PDFEditEngine(pdf_path)
+    engine.add_text(0, 72, 72, 'Stamp')
+    snapshot = engine.snapshot()
+    temp_path = snapshot.save(pdf_path, compact=True, replace=False)
+    assert stamps(pdf_path) == 0
+    engine.replace_file(temp_path, pdf_path)
+    engine.saved_in_place(snapshot.annotations.ids())
+    assert stamps(pdf_path) == 1
+    assert engine.document[0].get_text().count('Stamp') == 1
+
+
+def test_failed_copy_keeps_the_saved_file(pdf_path, monkeypatch):
+    def refuse(src, dst):
+        raise PermissionError(13, 'The process cannot access the file', dst)
+
+    def disk_full(src, dst):
+        with open(dst, 'r+b') as f:
+            f.truncate(10)  # the target is left half-written
+        raise OSError(28, 'No space left on device', dst)
+    monkeypatch.setattr('os.replace', refuse)
+    monkeypatch.setattr('shutil.copyfile', disk_full)
+    engine = PDFEditEngine(pdf_path)
+    engine.add_text(0, 72, 72, 'Stamp')
+    with pytest.raises(ReplaceFailed) as failure:
+        engine.save(pdf_path, compact=True)
+    assert failure.value.kept_path in str(failure.value)
+    assert stamps(failure.value.kept_path) == 1
@@ -0,0 +1,264 @@
+import heapq
+import marshal
+import os
+import re
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left
+from itertools import islice
+
+from background import BackgroundWorker
+from cache_files import cache_dir, write_atomic
+from lazy_imports import lazy_import
+
+fitz = lazy_import('fitz')  # PyMuPDF
+
+INDEX_FORMAT = 1
+POSITION_BITS = 20  # postings are page_num << POSITION_BITS | token position on the page
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def default_index_dir():
+    return cache_dir('text-index')
+
+
+def normalize(text):
+    # Case- and accent-insensitive, so "pagina" finds "Página"
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(normalize(text))
+
+
+def page_words(page):
+    # (x0, y0, x1, y1, word) in the same coordinates as overlays: points from
+    # the top-left of the page as displayed
+    words = page.get_text('words')
+    if page.rotation:
+        matrix = page.rotation_matrix
+        words = [tuple(fitz.Rect(w[:4]) * matrix) + (w[4],) for w in words]
+    return [w[:5] for w in words]
+
+
+class TextIndex:
+    # Token ids and boxes for every indexed page, plus an inverted index from
+    # token to postings. A query looks up its first term and only checks the
+    # positions that follow each posting, so repeat searches cost the number of
+    # hits rather than the size of the document. Pages can be added from a
+    # worker thread while the Tk thread searches.
+    MAX_HITS = 10000
+
+    def __init__(self, page_count):
+        self.page_count = page_count
+        self.pages = [None] * page_count  # page_num -> (array of token ids, array of x0, y0, x1, y1 per token)
+        self.tokens = []  # token id -> token
+        self.token_ids = {}  # token -> token id
+        self.postings = []  # token id -> array('Q') in page order
+        self.indexed = 0
+        self._word_ids = {}  # word as extracted -> its token ids; most words repeat
+        self._vocabulary = None  # sorted tokens for prefix lookups, rebuilt after changes
+        self._lock = threading.Lock()
+
+    @property
+    def complete(self):
+        return self.indexed >= self.page_count
+
+    def add_page(self, page_num, words):
+        ids = array('I')
+        boxes = array('f')
+        with self._lock:
+            if self.pages[page_num] is not None:
+                return
+            base = page_num << POSITION_BITS
+            for x0, y0, x1, y1, word in words:
+                word_ids = self._word_ids.get(word)
+                if word_ids is None:
+                    word_ids = self._word_ids[word] = tuple(self._token_id(token) for token in tokenize(word))
+                for token_id in word_ids:
+                    if len(ids) < 1 << POSITION_BITS:
+                        self.postings[token_id].append(base | len(ids))
+                    ids.append(token_id)
+                    boxes.extend((x0, y0, x1, y1))
+            self.pages[page_num] = (ids, boxes)
+            self.indexed += 1
+            self._vocabulary = None
+
+    def _token_id(self, token):
+        token_id = self.token_ids.get(token)
+        if token_id is None:
+            token_id = self.token_ids[token] = len(self.tokens)
+            self.tokens.append(token)
+            self.postings.append(array('Q'))
+        return token_id
+
+    def search(self, query):
+        # Returns [(page_num, [(x0, y0, x1, y1), ...])] in reading order. Terms
+        # must follow each other on the page; the last one may be a prefix, so
+        # results appear while a word is still being typed.
+        terms = tokenize(query)
+        if not terms:
+            return []
+        with self._lock:
+            last_ids = set(self._ids_with_prefix(terms[-1]))
+            if len(terms) == 1:
+                candidates = heapq.merge(*(self.postings[token_id] for token_id in last_ids))
+                middle_ids = []
+            else:
+                first_id = self.token_ids.get(terms[0])
+                middle_ids = [self.token_ids.get(term) for term in terms[1:-1]]
+                if first_id is None or None in middle_ids or not last_ids:
+                    return []
+                candidates = self.postings[first_id]
+            hits = []
+            for posting in candidates:
+                page_num, position = posting >> POSITION_BITS, posting & ((1 << POSITION_BITS) - 1)
+                ids, boxes = self.pages[page_num]
+                end = position + len(terms)
+                if end > len(ids) or ids[end - 1] not in last_ids:
+                    continue
+                if any(ids[position + 1 + i] != token_id for i, token_id in enumerate(middle_ids)):
+                    continue
+                hits.append((page_num, [tuple(boxes[i * 4:i * 4 + 4]) for i in range(position, end)]))
+                if len(hits) >= self.MAX_HITS:
+                    break
+            return hits
+
+    def _ids_with_prefix(self, prefix):
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.tokens)
+        matches = []
+        for token in islice(self._vocabulary, bisect_left(self._vocabulary, prefix), None):
+            if not token.startswith(prefix):
+                break
+            matches.append(self.token_ids[token])
+        return matches
+
+    def to_data(self):
+        with self._lock:
+            return {
+                'format': INDEX_FORMAT,
+                'page_count': self.page_count,
+                'tokens': self.tokens,
+                'pages': [(ids.tobytes(), boxes.tobytes()) for ids, boxes in self.pages],
+                'postings': [postings.tobytes() for postings in self.postings],
+            }
+
+    @classmethod
+    def from_data(cls, data):
+        index = cls(data['page_count'])
+        index.tokens = data['tokens']
+        index.token_ids = {token: token_id for token_id, token in enumerate(index.tokens)}
+        for page_num, (ids, boxes) in enumerate(data['pages']):
+            page_ids = array('I')
+            page_ids.frombytes(ids)
+            page_boxes = array('f')
+            page_boxes.frombytes(boxes)
+            index.pages[page_num] = (page_ids, page_boxes)
+        for raw in data['postings']:
+            postings = array('Q')
+            postings.frombytes(raw)
+            index.postings.append(postings)
+        index.indexed = index.page_count
+        return index
+
+
+class TextIndexStore:
+    # Finished indexes on disk, one marshal file per file content hash. Only
+    # the most recently used MAX_FILES are kept.
+    MAX_FILES = 50
+
+    def __init__(self, index_dir=None):
+        self.index_dir = index_dir or default_index_dir()
+
+    def _path(self, digest):
+        return os.path.join(self.index_dir, f"{digest}.idx")
+
+    def load(self, digest, page_count):
+        path = self._path(digest)
+        try:
+            with open(path, 'rb') as f:
+                data = marshal.load(f)
+            os.utime(path)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if not isinstance(data, dict) or data.get('format') != INDEX_FORMAT or data.get('page_count') != page_count:
+            return None
+        return TextIndex.from_data(data)
+
+    def store(self, digest, index):
+        os.makedirs(self.index_dir, exist_ok=True)
+        write_atomic(self._path(digest), marshal.dumps(index.to_data()))
+        self.cleanup()
+
+    def cleanup(self):
+        entries = []
+        for name in os.listdir(self.index_dir):
+            if name.endswith('.idx'):
+                path = os.path.join(self.index_dir, name)
+                try:
+                    entries.append((os.stat(path).st_mtime, path))
+                except OSError:
+                    continue
+        entries.sort(reverse=True)
+        for _, path in entries[self.MAX_FILES:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class TextIndexer(BackgroundWorker):
+    # Builds the TextIndex of one document on a background thread, page by
+    # page, or loads it from the store when this file content was indexed
+    # before. index can be searched at any time; on_progress(indexed,
+    # page_count) is called on the Tk thread as pages are added. digest()
+    # returns the file's content hash, the key in the store (see
+    # cache_files.SharedDigest).
+    POLL_MS = 200
+
+    def __init__(self, root, file_path, page_count, on_progress, digest, store=None, data=None):
+        super().__init__(root, file_path, data=data)
+        self.on_progress = on_progress
+        self.digest = digest
+        self.store = store or TextIndexStore()
+        self.index = TextIndex(page_count)
+        self._done = False
+        self._start()
+        self._poll_soon()
+
+    def _worker(self):
+        try:
+            digest = self.digest()
+        except OSError:
+            digest = ''  # no usable cache; build every time
+        cached = self.store.load(digest, self.index.page_count) if digest else None
+        if cached is not None:
+            self.index = cached
+        else:
+            doc = None
+            try:
+                doc = self._open_document()
+                for page_num in range(self.index.page_count):
+                    if self._closed:
+                        return
+                    self.index.add_page(page_num, page_words(doc.load_page(page_num)))
+            except Exception:
+                return  # search just covers the pages indexed so far
+            finally:
+                if doc is not None:
+                    doc.close()
+            if digest:
+                try:
+                    self.store.store(digest, self.index)
+                except OSError:
+                    pass
+        self._done = True
+
+    def _deliver(self):
+        self.on_progress(self.index.indexed, self.index.page_count)
+
+    def _active(self):
+        return not self._closed and not self._done and self._threads[0].is_alive()
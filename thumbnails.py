@@ -0,0 +1,320 @@
+import base64
+import json
+import os
+import threading
+import tkinter as tk
+from collections import OrderedDict, deque
+
+from background import BackgroundWorker
+from cache_files import cache_dir, file_content_hash, write_atomic
+from lazy_imports import lazy_import
+
+fitz = lazy_import('fitz')  # PyMuPDF
+
+THUMB_SIZE = 120  # longest side of a thumbnail, in pixels
+
+
+def default_cache_dir():
+    return cache_dir('thumbnails')
+
+
+def render_thumbnail(doc, page_num):
+    page = doc.load_page(page_num)
+    zoom = THUMB_SIZE / max(page.rect.width, page.rect.height, 1)
+    return page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False).tobytes('png')
+
+
+class ThumbnailCache:
+    # PNG thumbnails on disk, one directory per file content hash, so a file
+    # keeps its thumbnails when it is renamed or reopened. Reading a thumbnail
+    # refreshes its mtime, and cleanup() removes the least recently used ones
+    # once the cache is larger than max_bytes.
+    MAX_HASHES = 1000
+    CLEANUP_EVERY = 200  # stored thumbnails between size checks
+
+    def __init__(self, cache_dir=None, max_bytes=256 * 1024 * 1024):
+        self.cache_dir = cache_dir or default_cache_dir()
+        self.max_bytes = max_bytes
+        self._stores_since_cleanup = 0
+        self._lock = threading.Lock()
+
+    def content_hash(self, pdf_path):
+        # Hashing a huge file takes a while, so the hash is remembered per path,
+        # size and modification time
+        stat = os.stat(pdf_path)
+        key = os.path.abspath(pdf_path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        index_path = os.path.join(self.cache_dir, 'hashes.json')
+        with self._lock:
+            index = self._read_index(index_path)
+            entry = index.get(key)
+            if entry and entry[:2] == signature:
+                return entry[2]
+        digest = file_content_hash(pdf_path)
+        with self._lock:
+            index = self._read_index(index_path)
+            index.pop(key, None)
+            index[key] = signature + [digest]
+            while len(index) > self.MAX_HASHES:
+                del index[next(iter(index))]
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_atomic(index_path, json.dumps(index).encode('utf-8'))
+        return digest
+
+    @staticmethod
+    def _read_index(index_path):
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _path(self, digest, page_num):
+        return os.path.join(self.cache_dir, digest, f"{page_num}.png")
+
+    def load(self, digest, page_num):
+        path = self._path(digest, page_num)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return data
+
+    def store(self, digest, page_num, data):
+        path = self._path(digest, page_num)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        write_atomic(path, data)
+        self._stores_since_cleanup += 1
+        if self._stores_since_cleanup >= self.CLEANUP_EVERY:
+            self.cleanup()
+
+    def cleanup(self):
+        # Deletes the least recently used thumbnails until the cache is back
+        # under 90% of max_bytes; returns the resulting size
+        self._stores_since_cleanup = 0
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for name in filenames:
+                if not name.endswith('.png'): continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return total
+
+        entries.sort()
+        emptied = set()
+        for _, size, path in entries:
+            if total <= self.max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            emptied.add(os.path.dirname(path))
+        for dirpath in emptied:
+            try:
+                os.rmdir(dirpath)  # only succeeds once the directory is empty
+            except OSError:
+                pass
+        return total
+
+
+class ThumbnailLoader(BackgroundWorker):
+    # Produces thumbnails on one low-priority background thread: from the disk
+    # cache when possible, otherwise rendered and stored there. Like
+    # RenderScheduler, results are handed to on_result(page_num, png_bytes) on
+    # the Tk thread. digest, when given, returns the file's content hash (see
+    # cache_files.SharedDigest); otherwise the cache hashes the file itself.
+    POLL_MS = 50
+
+    def __init__(self, root, file_path, on_result, cache, data=None, digest=None):
+        super().__init__(root, file_path, data=data)
+        self.on_result = on_result
+        self.cache = cache
+        self.digest = digest or (lambda: cache.content_hash(file_path))
+        self._busy = False
+        self._start()
+
+    def schedule(self, pages):
+        # Replaces the queue with pages, in priority order
+        with self._cond:
+            self._pending = deque(pages)
+            self._cond.notify_all()
+        if pages:
+            self._poll_soon()
+
+    def _taking(self, page_num):
+        self._busy = True
+
+    def _worker(self):
+        doc = None
+        digest = None
+        while True:
+            page_num = self._next_item()
+            if page_num is None:
+                break
+            png = None
+            try:
+                if digest is None:
+                    try:
+                        digest = self.digest()
+                    except OSError:
+                        digest = ''  # no usable cache; render every time
+                png = self.cache.load(digest, page_num) if digest else None
+                if png is None:
+                    if doc is None:
+                        doc = self._open_document()
+                    png = render_thumbnail(doc, page_num)
+                    if digest:
+                        try:
+                            self.cache.store(digest, page_num, png)
+                        except OSError:
+                            pass
+            except Exception:
+                png = None
+            with self._cond:
+                self._busy = False
+                if png is not None:
+                    self._results.put((page_num, png))
+        if doc is not None:
+            doc.close()
+
+    def _deliver(self):
+        for page_num, png in self._results_so_far():
+            self.on_result(page_num, png)
+
+    def _active(self):
+        with self._cond:
+            return not self._closed and (self._pending or self._busy or not self._results.empty())
+
+
+class ThumbnailSidebar:
+    # Virtualized column of page thumbnails. Every page gets a slot of the same
+    # height, so only the slots in view have canvas items and thousands of pages
+    # cost nothing to lay out. Clicking a slot calls on_select(page_num).
+    SLOT_HEIGHT = THUMB_SIZE + 30
+    WIDTH = THUMB_SIZE + 24
+    MAX_IMAGES = 400  # thumbnails kept as Tk images
+
+    def __init__(self, parent, on_select, cache=None):
+        self.on_select = on_select
+        self.cache = cache or ThumbnailCache()
+        self.frame = tk.Frame(parent)
+        self.canvas = tk.Canvas(self.frame, width=self.WIDTH, bg="#e4e4e4", highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self.frame, orient=tk.VERTICAL, command=self.canvas.yview)
+        self.canvas.config(yscrollcommand=self._on_yscroll)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.Y, expand=1)
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<Configure>", lambda event: self._schedule_update())
+
+        self.loader = None
+        self.page_count = 0
+        self.current_page = 0
+        self._images = OrderedDict()  # page_num -> PhotoImage, least recently used first
+        self._slots = {}  # page_num -> (frame_id, image_id, label_id) for slots in view
+        self._update_id = None
+
+    def load(self, file_path, page_count, data=None, digest=None):
+        self.clear()
+        self.page_count = page_count
+        self.canvas.config(scrollregion=(0, 0, self.WIDTH, page_count * self.SLOT_HEIGHT))
+        self.canvas.yview_moveto(0)
+        self.loader = ThumbnailLoader(self.canvas, file_path, self._on_thumbnail, self.cache, data=data,
+                                      digest=digest)
+        self._schedule_update()
+
+    def clear(self):
+        if self.loader:
+            self.loader.close()
+        self.loader = None
+        self.canvas.delete("all")
+        self._images.clear()
+        self._slots.clear()
+        self.page_count = 0
+        self.current_page = 0
+
+    def set_current_page(self, page_num):
+        previous, self.current_page = self.current_page, page_num
+        for p in (previous, page_num):
+            if p in self._slots:
+                self.canvas.itemconfig(self._slots[p][0], **self._frame_style(p))
+        # Keep the highlighted thumbnail in view
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        y = page_num * self.SLOT_HEIGHT
+        if self.page_count and (y < top or y + self.SLOT_HEIGHT > bottom):
+            self.canvas.yview_moveto(max(0, y - (bottom - top - self.SLOT_HEIGHT) / 2) / (self.page_count * self.SLOT_HEIGHT))
+
+    def _frame_style(self, page_num):
+        if page_num == self.current_page:
+            return {'outline': "#3875d7", 'width': 3}
+        return {'outline': "#c0c0c0", 'width': 1}
+
+    def _on_yscroll(self, first, last):
+        self.scrollbar.set(first, last)
+        self._schedule_update()
+
+    def _schedule_update(self):
+        if self._update_id is None and self.page_count:
+            self._update_id = self.canvas.after_idle(self._update)
+
+    def _visible_range(self):
+        top = self.canvas.canvasy(0)
+        bottom = self.canvas.canvasy(self.canvas.winfo_height())
+        first = max(0, int(top // self.SLOT_HEIGHT))
+        last = min(self.page_count - 1, int(bottom // self.SLOT_HEIGHT))
+        return range(first, last + 1)
+
+    def _update(self):
+        self._update_id = None
+        if not self.page_count:
+            return
+        visible = self._visible_range()
+        for page_num in [p for p in self._slots if p not in visible]:
+            for item_id in self._slots.pop(page_num):
+                self.canvas.delete(item_id)
+        for page_num in visible:
+            if page_num not in self._slots:
+                self._draw_slot(page_num)
+
+        # The slots in view, then a screenful below them
+        ahead = range(visible.stop, min(self.page_count, visible.stop + len(visible)))
+        self.loader.schedule([p for p in list(visible) + list(ahead) if p not in self._images])
+
+    def _draw_slot(self, page_num):
+        x = self.WIDTH / 2
+        y = page_num * self.SLOT_HEIGHT + 4
+        half = THUMB_SIZE / 2 + 2
+        frame_id = self.canvas.create_rectangle(x - half, y, x + half, y + THUMB_SIZE + 4, fill="#d9d9d9",
+                                                **self._frame_style(page_num))
+        image = self._images.get(page_num)
+        if image is not None:
+            self._images.move_to_end(page_num)
+        image_id = self.canvas.create_image(x, y + half, image=image or '')
+        label_id = self.canvas.create_text(x, y + THUMB_SIZE + 16, text=str(page_num + 1))
+        self._slots[page_num] = (frame_id, image_id, label_id)
+
+    def _on_thumbnail(self, page_num, png):
+        if page_num >= self.page_count:
+            return
+        image = tk.PhotoImage(master=self.canvas, data=base64.b64encode(png))
+        self._images[page_num] = image
+        while len(self._images) > self.MAX_IMAGES:
+            self._images.popitem(last=False)
+        if page_num in self._slots:
+            self.canvas.itemconfig(self._slots[page_num][1], image=image)
+
+    def _on_click(self, event):
+        page_num = int(self.canvas.canvasy(event.y) // self.SLOT_HEIGHT)
+        if 0 <= page_num < self.page_count:
+            self.on_select(page_num)
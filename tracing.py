@@ -0,0 +1,99 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.name, self.category, self.start, time.perf_counter_ns(), self.args)
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    # Records timing spans into a fixed-size ring buffer, from any thread, and
+    # exports them as Chrome trace-event JSON (open it in chrome://tracing or
+    # https://ui.perfetto.dev). While disabled, span() hands back a shared no-op
+    # context manager, so instrumented code pays for one attribute check.
+    def __init__(self, capacity=100000, enabled=False):
+        self.enabled = enabled
+        self.events = deque(maxlen=capacity)  # (name, category, start_ns, end_ns, thread_id, args)
+        self.last_ms = {}  # span name -> duration of the latest one
+
+    def span(self, name, category='app', **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, category, args)
+
+    def record(self, name, category, start_ns, end_ns, args=None):
+        self.events.append((name, category, start_ns, end_ns, threading.get_ident(), args))
+        self.last_ms[name] = (end_ns - start_ns) / 1e6
+
+    def clear(self):
+        self.events.clear()
+        self.last_ms.clear()
+
+    def to_chrome_trace(self):
+        pid = os.getpid()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        events = []
+        for name, category, start_ns, end_ns, thread_id, args in list(self.events):
+            event = {'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': thread_id,
+                     'ts': start_ns / 1000, 'dur': (end_ns - start_ns) / 1000}
+            if args:
+                event['args'] = args
+            events.append(event)
+        for thread_id in {event['tid'] for event in events}:
+            events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread_id,
+                           'args': {'name': thread_names.get(thread_id, f"thread-{thread_id}")}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace(), f)
+        return len(self.events)
+
+
+def traced(name, category='app'):
+    # Decorator form of tracer.span() for a whole function
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            with _Span(tracer, name, category, None):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+# Shared by the engine, the render workers and the editor. Set XOCOPDF_TRACE=1
+# to record from startup, e.g. to capture a hang that happens while opening.
+tracer = Tracer(enabled=bool(os.environ.get('XOCOPDF_TRACE')))